@@ -2,24 +2,8 @@
 REM Activate the Python virtual environment
 call venv\Scripts\activate
 
-REM Run the Python scripts
-python src\data_import\import_ftp_ecmwf.py
-if %errorlevel% neq 0 goto :error
-
-python src\visualization\rain_thiessen.py
-if %errorlevel% neq 0 goto :error
-
-python src\animation\rain_animation.py
-if %errorlevel% neq 0 goto :error
-
-python src\get_dam_data\dam_data.py
-if %errorlevel% neq 0 goto :error
-
-REM Run the batch scripts
-call src\data_import\import_automation.bat
-if %errorlevel% neq 0 goto :error
-
-call src\forecast\forecast_hec_hms.bat
+REM Run the pipeline stages in dependency order, independent stages in parallel
+python src\pipeline\orchestrator.py %*
 if %errorlevel% neq 0 goto :error
 
 REM End of the process
@@ -0,0 +1,82 @@
+import os
+import hashlib
+import numpy as np
+import geopandas as gpd
+from affine import Affine
+from rasterio.features import geometry_mask
+from shapefiles import shapefile_digest
+
+
+CACHE_VERSION = "1"
+
+# Geometries and masks already loaded in this process, keyed like their cache files
+_geometries = {}
+_masks = {}
+
+
+def _cache_path(cache_folder, shp_path, key_parts, extension):
+    digest = hashlib.sha1()
+    digest.update(CACHE_VERSION.encode())
+    digest.update(shapefile_digest(shp_path).encode())
+    for part in key_parts:
+        digest.update(str(part).encode())
+    stem = os.path.splitext(os.path.basename(shp_path))[0]
+    return os.path.join(cache_folder, "geometry", f"{stem}_{digest.hexdigest()[:16]}{extension}")
+
+
+def read_geometry(shp_path, crs, cache_folder="data/cache"):
+    """Return a shapefile reprojected to ``crs``, cached as GeoParquet.
+
+    The cache file under ``<cache_folder>/geometry`` is named by a hash of the
+    shapefile contents and the CRS, so an edited shapefile is re-read
+    automatically. Each geometry is loaded at most once per process.
+    """
+    path = _cache_path(cache_folder, shp_path, [crs], ".parquet")
+    if path in _geometries:
+        return _geometries[path]
+
+    if os.path.exists(path):
+        geometry = gpd.read_parquet(path)
+    else:
+        geometry = gpd.read_file(shp_path).to_crs(crs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        geometry.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+    _geometries[path] = geometry
+    return geometry
+
+
+def coords_transform(xs, ys):
+    """Affine transform of a regular grid given its 1-D cell-centre coordinates."""
+    dx = xs[1] - xs[0] if len(xs) > 1 else 1.0
+    dy = ys[1] - ys[0] if len(ys) > 1 else -1.0
+    return Affine(dx, 0.0, xs[0] - dx / 2, 0.0, dy, ys[0] - dy / 2)
+
+
+def grid_mask(shp_path, crs, transform, shape, cache_folder="data/cache", all_touched=False):
+    """Boolean mask of the grid cells covered by a shapefile, cached as ``.npz``.
+
+    ``transform`` and ``shape`` describe the grid in ``crs``, e.g. the ECMWF
+    lat/lon grid (see ``coords_transform``) or a model's 2000 m grid. Cells
+    are selected by centre, as ``rio.clip`` does, unless ``all_touched``.
+    """
+    path = _cache_path(cache_folder, shp_path, [crs, tuple(transform), tuple(shape), all_touched], ".npz")
+    if path in _masks:
+        return _masks[path]
+
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            mask = cached["mask"]
+    else:
+        geometry = read_geometry(shp_path, crs, cache_folder)
+        mask = geometry_mask(geometry.geometry, out_shape=tuple(shape), transform=transform,
+                             all_touched=all_touched, invert=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, mask=mask)
+        os.replace(tmp_path, path)
+
+    _masks[path] = mask
+    return mask
@@ -0,0 +1,94 @@
+"""Lookup of the basin-cropped ECMWF cache written by ``crop_ecmwf.py``.
+
+Each cropped file sits in the cache folder under the raw file's name, with
+a ``.json`` sidecar recording the raw file it came from, the shapefiles its
+bounding box covers and its offset in the full grid. Readers use the cropped
+file only while the raw file and those shapefiles are unchanged, and fall
+back to the raw file otherwise. Plain Python, so the Jython stages can use
+it too.
+"""
+import os
+import json
+
+from shapefiles import shapefile_digest
+
+
+DEFAULT_FOLDER = "data/cache/ecmwf"
+
+
+def cache_path(raw_path, cache_folder):
+    """Path of the cropped copy of a raw ECMWF file."""
+    return os.path.join(cache_folder, os.path.basename(raw_path))
+
+
+def info_path(nc_path):
+    return nc_path + ".json"
+
+
+def source_signature(path):
+    """Size and modification time of a raw file."""
+    stat = os.stat(path)
+    return "{}:{}".format(stat.st_size, int(stat.st_mtime))
+
+
+def model_shapefiles(model_config):
+    """Shapefiles whose extent a model reads from the rain grid."""
+    return [path for path in (model_config.get("clip_shp"), model_config.get("basin_shp")) if path]
+
+
+def read_cache_info(nc_path):
+    """The sidecar of a cropped file, or None for a raw file."""
+    path = info_path(nc_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_cache_info(nc_path, info):
+    """Write a cropped file's sidecar.
+
+    While it is being replaced a reader may find no sidecar and use the raw
+    file, never a sidecar that does not match the cropped file.
+    """
+    path = info_path(nc_path)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def cached_file(raw_path, cache_folder, shp_paths):
+    """The cropped copy of ``raw_path`` if it is current and covers ``shp_paths``, else None.
+
+    A cropped file whose raw file has been removed (e.g. archived) is still
+    used.
+    """
+    path = cache_path(raw_path, cache_folder)
+    if not os.path.exists(path):
+        return None
+    info = read_cache_info(path)
+    if info is None:
+        return None
+    if os.path.exists(raw_path) and info.get("source_signature") != source_signature(raw_path):
+        return None
+    covered = info.get("shapefiles", {})
+    for shp_path in shp_paths:
+        if covered.get(os.path.abspath(shp_path)) != shapefile_digest(shp_path):
+            return None
+    return path
+
+
+def preferred_file(raw_path, cache_folder, shp_paths):
+    """The cropped copy of ``raw_path`` when it can be used, otherwise ``raw_path`` itself."""
+    return cached_file(raw_path, cache_folder, shp_paths) or raw_path
+
+
+def grid_offset(nc_path):
+    """(lat, lon) index of a file's first cell in the full ECMWF grid; (0, 0) for a raw file."""
+    info = read_cache_info(nc_path)
+    if info is None:
+        return 0, 0
+    return info["lat_offset"], info["lon_offset"]
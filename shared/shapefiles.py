@@ -0,0 +1,18 @@
+"""Shapefile fingerprint used as a cache key by the CPython and Jython stages."""
+import os
+import hashlib
+
+
+SHAPEFILE_EXTENSIONS = [".shp", ".shx", ".dbf", ".prj"]
+
+
+def shapefile_digest(shp_path):
+    """Hash the contents of a shapefile and its sidecar files."""
+    digest = hashlib.sha1()
+    base = os.path.splitext(shp_path)[0]
+    for extension in SHAPEFILE_EXTENSIONS:
+        path = base + extension
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
@@ -0,0 +1,231 @@
+"""Pipeline state shared by the CPython and Jython stages.
+
+One SQLite database in WAL mode holds a row per (stage, model, date) with
+its status, timing and input hash. CPython uses ``sqlite3``; Jython uses
+zxJDBC with the sqlite-jdbc driver (``org.sqlite.JDBC``) on the CLASSPATH.
+Every state change is a single SQL statement, so it is atomic in both.
+"""
+import os
+import socket
+import threading
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    # Jython 2.7
+    sqlite3 = None
+    from com.ziclix.python.sql import zxJDBC
+
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A claim older than this is considered abandoned by a crashed worker
+STALE_SECONDS = 6 * 3600
+
+DEFAULT_PATH = "logs/pipeline_state.sqlite"
+
+
+def _connect(db_path):
+    if sqlite3 is not None:
+        return sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn = zxJDBC.connect("jdbc:sqlite:" + db_path, None, None, "org.sqlite.JDBC")
+    conn.autocommit = True
+    return conn
+
+
+class StateStore(object):
+    """Status of each (stage, model, date) of the pipeline."""
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.lock = threading.Lock()
+        self.conn = _connect(db_path)
+        self.worker = "{}:{}".format(socket.gethostname(), os.getpid())
+        self._execute("PRAGMA busy_timeout = 30000")
+        self._execute("PRAGMA journal_mode = WAL")
+        self._execute(
+            """
+            CREATE TABLE IF NOT EXISTS stage_runs (
+                stage TEXT NOT NULL,
+                model TEXT NOT NULL,
+                date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                input_hash TEXT,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                started_at REAL,
+                finished_at REAL,
+                duration_seconds REAL,
+                error TEXT,
+                PRIMARY KEY (stage, model, date)
+            )
+            """
+        )
+        self._execute("CREATE INDEX IF NOT EXISTS stage_runs_status ON stage_runs (stage, status, date)")
+
+    def _execute(self, sql, params=(), fetch=False):
+        """Run one statement; returns the fetched rows, or the number of changed rows."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(sql, tuple(params))
+                if fetch:
+                    return [tuple(row) for row in cursor.fetchall()]
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    def close(self):
+        self.conn.close()
+
+    def claim(self, stage, model, date, input_hash=None, stale_seconds=STALE_SECONDS):
+        """Atomically take a (stage, model, date) for this worker. Returns True if claimed.
+
+        A new item, a failed one, a done one whose inputs changed, or a
+        running one whose claim went stale can be claimed; anything else
+        belongs to another worker or is finished. A done item recorded
+        without an input hash (e.g. migrated from a ledger) counts as
+        unchanged.
+        """
+        now = time.time()
+        changed = self._execute(
+            """
+            INSERT INTO stage_runs (stage, model, date, status, input_hash, worker, started_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (stage, model, date) DO UPDATE SET
+                status = excluded.status,
+                input_hash = excluded.input_hash,
+                worker = excluded.worker,
+                attempts = stage_runs.attempts + 1,
+                started_at = excluded.started_at,
+                finished_at = NULL,
+                duration_seconds = NULL,
+                error = NULL
+            WHERE stage_runs.status = ?
+               OR (stage_runs.status = ? AND excluded.input_hash IS NOT NULL
+                   AND stage_runs.input_hash IS NOT NULL
+                   AND stage_runs.input_hash IS NOT excluded.input_hash)
+               OR (stage_runs.status = ? AND stage_runs.started_at < ?)
+            """,
+            (stage, model, date, RUNNING, input_hash, self.worker, now, FAILED, DONE, RUNNING, now - stale_seconds),
+        )
+        return changed == 1
+
+    def complete(self, stage, model, date):
+        """Mark a claimed item as done and record its duration."""
+        now = time.time()
+        self._execute(
+            """
+            UPDATE stage_runs SET status = ?, finished_at = ?, duration_seconds = ? - started_at
+            WHERE stage = ? AND model = ? AND date = ?
+            """,
+            (DONE, now, now, stage, model, date),
+        )
+
+    def fail(self, stage, model, date, error=None):
+        """Mark a claimed item as failed so that it can be claimed again."""
+        now = time.time()
+        self._execute(
+            """
+            UPDATE stage_runs SET status = ?, finished_at = ?, duration_seconds = ? - started_at, error = ?
+            WHERE stage = ? AND model = ? AND date = ?
+            """,
+            (FAILED, now, now, None if error is None else str(error), stage, model, date),
+        )
+
+    def is_done(self, stage, model, date):
+        rows = self._execute(
+            "SELECT 1 FROM stage_runs WHERE stage = ? AND model = ? AND date = ? AND status = ?",
+            (stage, model, date, DONE), fetch=True,
+        )
+        return bool(rows)
+
+    def done_dates(self, stage, model):
+        """Set of dates a stage has completed for a model."""
+        rows = self._execute(
+            "SELECT date FROM stage_runs WHERE stage = ? AND model = ? AND status = ?",
+            (stage, model, DONE), fetch=True,
+        )
+        return set(row[0] for row in rows)
+
+    def pending(self, stage, items):
+        """The (model, date) items that are neither done nor running for a stage."""
+        busy = set(
+            (row[0], row[1]) for row in self._execute(
+                "SELECT model, date FROM stage_runs WHERE stage = ? AND status IN (?, ?)",
+                (stage, DONE, RUNNING), fetch=True,
+            )
+        )
+        return [item for item in items if tuple(item) not in busy]
+
+    def runs(self, stage=None, status=None):
+        """Rows of (stage, model, date, status, attempts, started_at, duration_seconds, error)."""
+        sql = "SELECT stage, model, date, status, attempts, started_at, duration_seconds, error FROM stage_runs WHERE 1 = 1"
+        params = []
+        if stage is not None:
+            sql += " AND stage = ?"
+            params.append(stage)
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        return self._execute(sql + " ORDER BY date, stage, model", params, fetch=True)
+
+    def migrate_ledger(self, stage, model, ledger_path):
+        """Record the dates of a legacy text ledger as done, once, then rename the ledger.
+
+        Several processes may migrate the same ledger at once; the inserts
+        are idempotent and whichever loses the rename leaves it to the other.
+        """
+        if not os.path.exists(ledger_path):
+            return 0
+        try:
+            with open(ledger_path, "r") as f:
+                dates = set(line.strip() for line in f if line.strip())
+        except IOError:
+            # Renamed by another process since the check
+            if os.path.exists(ledger_path):
+                raise
+            return 0
+        for date in dates:
+            self._execute(
+                """
+                INSERT OR IGNORE INTO stage_runs (stage, model, date, status, worker)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (stage, model, date, DONE, "migrated"),
+            )
+        migrated_path = ledger_path + ".migrated"
+        try:
+            if os.path.exists(migrated_path):
+                os.remove(migrated_path)
+            os.rename(ledger_path, migrated_path)
+        except OSError:
+            # Another process renamed the ledger first
+            if os.path.exists(ledger_path):
+                raise
+        return len(dates)
+
+
+def file_signature(path):
+    """Cheap input hash of a file: its name, size and modification time."""
+    stat = os.stat(path)
+    return "{}:{}:{}".format(os.path.basename(path), stat.st_size, int(stat.st_mtime))
+
+
+def open_state_store(config):
+    """Open the configured state store, importing any legacy text ledgers first.
+
+    ``processed_dates_log`` becomes the model's "import" records and
+    ``logs/<model>_forecast_dates.txt`` its "forecast" records.
+    """
+    store = StateStore(config["shared"].get("state_store", DEFAULT_PATH))
+    for model_name, model_config in config["models"].items():
+        if model_config.get("processed_dates_log"):
+            store.migrate_ledger("import", model_name, model_config["processed_dates_log"])
+        store.migrate_ledger("forecast", model_name, "logs/{}_forecast_dates.txt".format(model_name))
+    return store
@@ -0,0 +1,96 @@
+import numpy as np
+from PIL import Image
+
+try:
+    import imageio_ffmpeg
+except ImportError:
+    imageio_ffmpeg = None
+
+
+FORMATS = ("gif", "webp", "mp4")
+
+
+def _palette_image(frame, palette):
+    image = Image.fromarray(frame, "P")
+    image.putpalette(palette)
+    return image
+
+
+def _rgb_frames(frames, palette):
+    lut = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    return (lut[frame] for frame in frames)
+
+
+def write_gif(frames, palette, save_path, duration, transparent_index):
+    """Write palette-indexed frames as a GIF, storing only pixels that changed.
+
+    Every frame after the first marks pixels equal to the previous frame with
+    ``transparent_index`` and is drawn over it (disposal 1), so the encoder
+    only stores the changed region with long runs of one index.
+    """
+    images = []
+    previous = None
+    for frame in frames:
+        delta = frame
+        if previous is not None:
+            delta = frame.copy()
+            delta[frame == previous] = transparent_index
+        images.append(_palette_image(delta, palette))
+        previous = frame
+
+    images[0].save(
+        save_path,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+        transparency=transparent_index,
+        disposal=1,
+    )
+
+
+def write_webp(frames, palette, save_path, duration):
+    """Write frames as a lossless animated WebP; libwebp stores only changed sub-rectangles."""
+    images = [Image.fromarray(frame) for frame in _rgb_frames(frames, palette)]
+    images[0].save(
+        save_path,
+        format="WEBP",
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+        lossless=True,
+        method=4,
+    )
+
+
+def write_mp4(frames, palette, save_path, duration):
+    """Write frames as an H.264 MP4 through imageio-ffmpeg."""
+    if imageio_ffmpeg is None:
+        raise ImportError("MP4 output requires the imageio-ffmpeg package.")
+    height, width = frames[0].shape
+    writer = imageio_ffmpeg.write_frames(
+        save_path,
+        (width, height),
+        fps=1000.0 / duration,
+        codec="libx264",
+        pix_fmt_in="rgb24",
+        pix_fmt_out="yuv420p",
+        macro_block_size=2,
+    )
+    writer.send(None)
+    for frame in _rgb_frames(frames, palette):
+        writer.send(np.ascontiguousarray(frame))
+    writer.close()
+
+
+def write_animation(frames, palette, save_path, output_format, duration, transparent_index):
+    """Write palette-indexed frames (2-D uint8 arrays) in the requested format."""
+    if output_format == "gif":
+        write_gif(frames, palette, save_path, duration, transparent_index)
+    elif output_format == "webp":
+        write_webp(frames, palette, save_path, duration)
+    elif output_format == "mp4":
+        write_mp4(frames, palette, save_path, duration)
+    else:
+        raise ValueError(f"Unsupported animation format: {output_format}. Choose one of {', '.join(FORMATS)}.")
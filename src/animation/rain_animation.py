@@ -1,17 +1,32 @@
 import os
+import sys
 import logging
 import yaml
 from datetime import datetime, timedelta
 import xarray as xr
-import geopandas as gpd
 import pandas as pd
 import rioxarray
-from rasterio.warp import calculate_default_transform, Resampling
+from rasterio.warp import calculate_default_transform, transform_bounds, Resampling
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
+from matplotlib import font_manager
+from matplotlib.cm import ScalarMappable
 import numpy as np
 from matplotlib.colors import ListedColormap, BoundaryNorm
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+from animation_writer import write_animation
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from geometry_cache import read_geometry, coords_transform, grid_mask
+from rain_cache import DEFAULT_FOLDER, model_shapefiles, preferred_file
+
+
+# Display grid (transform, shape) per model and source grid, see display_grid()
+_display_grids = {}
+
+# Static layers used by render_frame() in each worker process
+_renderer = None
 
 
 def load_config(config_path="shared/config.yaml"):
@@ -64,85 +79,220 @@ def find_yesterdays_file(raw_folder, yesterday, logger):
 
 
 
-def create_animation(data, title, save_path, extent, basin_shp, cmap, norm, logger):
-    """Create and save a rainfall animation with a basin shapefile overlay."""
-    try:
-        x_dim, y_dim = data.rio.x_dim, data.rio.y_dim
-        time_dim = "time"
+def display_grid(model_name, clipped_data, projected_crs, resolution=2000):
+    """Return the (transform, shape) of a model's lat/lon display grid.
 
-        crs_proj = ccrs.PlateCarree()
-        fig, ax = plt.subplots(figsize=(8, 12), subplot_kw={"projection": crs_proj})
-
-        # Set extent
-        ax.set_extent(extent, crs=crs_proj)
-
-        # Display initial frame
-        initial_frame = data["rain"].isel({time_dim: 0})
-        cax = ax.imshow(
-            initial_frame.values,
-            cmap=cmap,
-            norm=norm,
-            origin="upper",
-            extent=[
-                initial_frame["x"].min(),
-                initial_frame["x"].max(),
-                initial_frame["y"].min(),
-                initial_frame["y"].max(),
-            ],
-            transform=crs_proj,
+    The grid has the footprint and cell count of the 2000 m grid in the
+    model's projected CRS, expressed in EPSG:4326, so frames can be drawn
+    with a single bilinear warp from the source grid. It is cached per model
+    and source grid geometry.
+    """
+    key = (model_name, projected_crs, resolution, clipped_data.rio.shape, tuple(clipped_data.rio.transform()))
+    if key not in _display_grids:
+        left, bottom, right, top = transform_bounds(clipped_data.rio.crs, projected_crs, *clipped_data.rio.bounds())
+        width = max(1, int(np.ceil((right - left) / resolution)))
+        height = max(1, int(np.ceil((top - bottom) / resolution)))
+        transform, dst_width, dst_height = calculate_default_transform(
+            projected_crs, "EPSG:4326", width, height, left, bottom, right, top, dst_width=width, dst_height=height
         )
+        _display_grids[key] = (transform, (dst_height, dst_width))
+    return _display_grids[key]
 
-        # Plot basin shapefile
-        basin_shp.plot(ax=ax, facecolor="none", edgecolor="blue", linewidth=1, transform=crs_proj)
-
-        # Add colorbar below the plot
-        cbar_ax = fig.add_axes([0.15, 0.1, 0.7, 0.03])
-        fig.colorbar(cax, cax=cbar_ax, orientation='horizontal', label='Rainfall (mm)', boundaries=norm.boundaries, ticks=norm.boundaries)
-
-        # Add longitude and latitude gridlines (only left and bottom)
-        gl = ax.gridlines(
-            draw_labels=True,
-            crs=crs_proj,
-            linewidth=0.5,
-            color="gray",
-            alpha=0.7,
-            linestyle="--"
-        )
-        gl.top_labels = False
-        gl.right_labels = False
-        gl.left_labels = True
-        gl.bottom_labels = True
-        gl.xlabel_style = {"fontsize": 10}
-        gl.ylabel_style = {"fontsize": 10}
-
-        ax.set_xlabel("Longitude", fontsize=14)
-        ax.set_ylabel("Latitude", fontsize=14)
-        
-        
-        def update(frame):
-            ax.set_title(
+
+def open_rain_dataset(data_file):
+    """Open an ECMWF file as a dataset with ``x``/``y`` spatial dimensions in EPSG:4326."""
+    data = xr.open_dataset(data_file).rio.write_crs("EPSG:4326")
+
+    # Dynamically rename dimensions if needed
+    if 'lon' in data.dims and 'lat' in data.dims:
+        data = data.rename({'lon': 'x', 'lat': 'y'})
+    elif 'longitude' in data.dims and 'latitude' in data.dims:
+        data = data.rename({'longitude': 'x', 'latitude': 'y'})
+
+    # Ensure spatial dimensions are set
+    return data.rio.set_spatial_dims(x_dim='x', y_dim='y', inplace=False)
+
+
+def clip_to_mask(data, mask):
+    """Crop data to the bounding box of a grid mask and blank the cells outside it, like ``rio.clip``."""
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        raise ValueError("The clip shapefile does not cover any cell of the data grid.")
+    rows, cols = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+    cropped = data.isel(y=rows, x=cols)
+    return cropped.where(xr.DataArray(mask[rows, cols], dims=("y", "x")))
+
+
+def render_static_layers(data, extent, basin_shp, cmap, norm):
+    """Draw the parts of the animation that never change, once.
+
+    The full figure (colorbar, labels, gridlines, basin outline) is quantized
+    once into the shared frame palette: the rain classes come first, then the
+    transparent and title entries, then the background colours. Returns a
+    renderer state holding the background as palette indices, a mask of the
+    lines drawn above the rainfall inside the map axes, the axes pixel box,
+    the title anchor and per-pixel lookups from the map box into the data grid.
+    """
+    crs_proj = ccrs.PlateCarree()
+    fig, ax = plt.subplots(figsize=(8, 12), subplot_kw={"projection": crs_proj})
+
+    # Set extent
+    ax.set_extent(extent, crs=crs_proj)
+
+    # Plot basin shapefile
+    basin_shp.plot(ax=ax, facecolor="none", edgecolor="blue", linewidth=1, transform=crs_proj)
+
+    # Add colorbar below the plot
+    cbar_ax = fig.add_axes([0.15, 0.1, 0.7, 0.03])
+    fig.colorbar(ScalarMappable(norm=norm, cmap=cmap), cax=cbar_ax, orientation='horizontal', label='Rainfall (mm)', boundaries=norm.boundaries, ticks=norm.boundaries)
+
+    # Add longitude and latitude gridlines (only left and bottom)
+    gl = ax.gridlines(
+        draw_labels=True,
+        crs=crs_proj,
+        linewidth=0.5,
+        color="gray",
+        alpha=0.7,
+        linestyle="--"
+    )
+    gl.top_labels = False
+    gl.right_labels = False
+    gl.left_labels = True
+    gl.bottom_labels = True
+    gl.xlabel_style = {"fontsize": 10}
+    gl.ylabel_style = {"fontsize": 10}
+
+    ax.set_xlabel("Longitude", fontsize=14)
+    ax.set_ylabel("Latitude", fontsize=14)
+
+    # Reserve the space of the two-line title drawn on each frame
+    ax.set_title(" \n ", fontsize=18, pad=20)
+
+    fig.canvas.draw()
+    background = np.asarray(fig.canvas.buffer_rgba())[..., :3].copy()
+    height = background.shape[0]
+    bbox = ax.get_window_extent()
+    top, bottom = int(round(height - bbox.y1)), int(round(height - bbox.y0))
+    left, right = int(round(bbox.x0)), int(round(bbox.x1))
+    title_bbox = ax.title.get_window_extent()
+    x0, x1, y0, y1 = ax.get_extent(crs=crs_proj)
+
+    # Lines above the rainfall, rendered on a transparent canvas
+    fig.patch.set_alpha(0)
+    ax.patch.set_visible(False)
+    fig.canvas.draw()
+    overlay_alpha = np.asarray(fig.canvas.buffer_rgba())[top:bottom, left:right, 3]
+    plt.close(fig)
+
+    # Frame palette: rain classes, transparent, title, then the quantized background
+    class_colors = (cmap(np.arange(cmap.N)) * 255).astype(np.uint8)[:, :3]
+    n_classes = len(class_colors)
+    background_offset = n_classes + 2
+    quantized = Image.fromarray(background).quantize(
+        colors=256 - background_offset, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE
+    )
+    background_colors = np.asarray(quantized.getpalette(), dtype=np.uint8).reshape(-1, 3)[:256 - background_offset]
+    palette = np.concatenate([class_colors, [[255, 255, 255], [0, 0, 0]], background_colors])
+    palette = np.pad(palette, ((0, 256 - len(palette)), (0, 0)))
+
+    # Data cell under each pixel of the map box
+    xs, ys = data["x"].values, data["y"].values
+    dx = xs[1] - xs[0] if len(xs) > 1 else 1.0
+    dy = ys[1] - ys[0] if len(ys) > 1 else -1.0
+    lon = x0 + (np.arange(right - left) + 0.5) / (right - left) * (x1 - x0)
+    lat = y1 - (np.arange(bottom - top) + 0.5) / (bottom - top) * (y1 - y0)
+    col_idx = np.floor((lon - (xs[0] - dx / 2)) / dx).astype(np.intp)
+    row_idx = np.floor((lat - (ys[0] - dy / 2)) / dy).astype(np.intp)
+    inside = ((row_idx >= 0) & (row_idx < len(ys)))[:, None] & ((col_idx >= 0) & (col_idx < len(xs)))[None, :]
+
+    return {
+        "background": (np.asarray(quantized) + background_offset).astype(np.uint8),
+        "palette": palette.ravel().tolist(),
+        "transparent_index": n_classes,
+        "text_index": n_classes + 1,
+        "line_mask": overlay_alpha >= 64,
+        "box": (top, bottom, left, right),
+        "title_xy": ((bbox.x0 + bbox.x1) / 2, height - title_bbox.y0),
+        "font_path": font_manager.findfont(font_manager.FontProperties()),
+        "font_size": int(round(18 * fig.dpi / 72)),
+        "row_idx": np.clip(row_idx, 0, len(ys) - 1),
+        "col_idx": np.clip(col_idx, 0, len(xs) - 1),
+        "inside": inside,
+        "boundaries": np.asarray(norm.boundaries),
+        "n_classes": n_classes,
+    }
+
+
+def _init_renderer(state):
+    """Keep the static layers in the worker and load the title font once."""
+    global _renderer
+    _renderer = dict(state, font=ImageFont.truetype(state["font_path"], state["font_size"]))
+
+
+def render_frame(values, title):
+    """Classify one rainfall frame into a palette-indexed (uint8) array over the static layers."""
+    state = _renderer
+    top, bottom, left, right = state["box"]
+
+    # BoundaryNorm lookup: values below the first boundary use the first
+    # class and values above the last use the last, as with clip=False.
+    # Class k is palette index k.
+    classes = np.clip(np.digitize(values, state["boundaries"]) - 1, 0, state["n_classes"] - 1).astype(np.uint8)
+    pixels = classes[state["row_idx"][:, None], state["col_idx"][None, :]]
+    valid = state["inside"] & ~np.isnan(values)[state["row_idx"][:, None], state["col_idx"][None, :]]
+    valid &= ~state["line_mask"]
+
+    frame = state["background"].copy()
+    region = frame[top:bottom, left:right]
+    region[valid] = pixels[valid]
+
+    image = Image.fromarray(frame, "P")
+    draw = ImageDraw.Draw(image)
+    draw.fontmode = "1"
+    draw.multiline_text(state["title_xy"], title, fill=state["text_index"], font=state["font"], anchor="md", align="center")
+    return np.asarray(image)
+
+
+def _render_frame_task(args):
+    return render_frame(*args)
+
+
+def create_animation(data, title, save_path, extent, basin_shp, cmap, norm, logger, workers=None, output_format="gif"):
+    """Create and save a rainfall animation with a basin shapefile overlay.
+
+    The static layers are rasterized once; frames are then classified into
+    palette indices on a process pool and written as GIF, WebP or MP4.
+    """
+    try:
+        time_dim = "time"
+        state = render_static_layers(data, extent, basin_shp, cmap, norm)
+
+        tasks = [
+            (
+                data["rain"].isel({time_dim: frame}).values,
                 f"{title}\n{pd.to_datetime(data[time_dim].values[frame]).strftime('%d %B %Y %H:%M')}",
-                fontsize=18,
-                pad=20
             )
-            frame_data = data["rain"].isel({time_dim: frame})
-            cax.set_data(frame_data.values)
-            return cax,
+            for frame in range(len(data[time_dim]))
+        ]
 
-        # Create the animation
-        ani = FuncAnimation(fig, update, frames=len(data[time_dim]), interval=1000, repeat=False)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_renderer, initargs=(state,)) as executor:
+            frames = list(executor.map(_render_frame_task, tasks))
 
         # Save animation
-        ani.save(save_path, writer="pillow", fps=1)
-        plt.close(fig)
+        write_animation(frames, state["palette"], save_path, output_format, 1000, state["transparent_index"])
         logger.info(f"Animation saved to {save_path}")
     except Exception as e:
         logger.error(f"Failed to create animation: {e}")
         raise
 
 
-def process_model_rain_animation(model_name, model_config, shared_config, cmap, norm):
-    """Generate rainfall animation for a specific model."""
+def process_model_rain_animation(model_name, model_config, shared_config, cmap, norm, dataset=None):
+    """Generate rainfall animation for a specific model.
+
+    ``dataset`` is an already loaded rain cube with ``x``/``y`` dimensions
+    and a CRS, e.g. from the pipeline daemon; without it yesterday's file is
+    opened from the basin-cropped cache, or from the raw folder.
+    """
     log_file = os.path.join(model_config["animation_output"], f"{model_name}_animation.log")
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
     logger = setup_logger(log_file)
@@ -151,15 +301,20 @@ def process_model_rain_animation(model_name, model_config, shared_config, cmap,
     yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
     today = datetime.now().strftime("%Y%m%d")
 
-    data_file = find_yesterdays_file(raw_folder, yesterday, logger)
-    if not data_file:
-        logger.warning(f"No NetCDF file found for {model_name} on {yesterday}. Skipping animation.")
-        return
+    if dataset is None:
+        data_file = find_yesterdays_file(raw_folder, yesterday, logger)
+        if not data_file:
+            logger.warning(f"No NetCDF file found for {model_name} on {yesterday}. Skipping animation.")
+            return
+        data_file = preferred_file(data_file, shared_config.get("ecmwf_cache", DEFAULT_FOLDER), model_shapefiles(model_config))
+    else:
+        data_file = dataset.encoding.get("source", "the loaded cube")
 
     output_dir = model_config["animation_output"]
     os.makedirs(output_dir, exist_ok=True)
 
-    save_path = os.path.join(output_dir, f"rainfall_{model_name}_{today}.gif")
+    output_format = shared_config.get("animation_format", "gif")
+    save_path = os.path.join(output_dir, f"rainfall_{model_name}_{today}.{output_format}")
     path_clip_shp = model_config["clip_shp"]
     path_basin_shp = model_config["basin_shp"]
     projected_crs = model_config["projected_crs"]
@@ -167,44 +322,29 @@ def process_model_rain_animation(model_name, model_config, shared_config, cmap,
     logger.info(f"Processing rainfall animation for {model_name} using file {data_file}...")
 
     # Load data and shapefiles
-    data = xr.open_dataset(data_file).rio.write_crs("EPSG:4326")
-
-    # Dynamically rename dimensions if needed
-    if 'lon' in data.dims and 'lat' in data.dims:
-        data = data.rename({'lon': 'x', 'lat': 'y'})
-    elif 'longitude' in data.dims and 'latitude' in data.dims:
-        data = data.rename({'longitude': 'x', 'latitude': 'y'})
-
-    # Ensure spatial dimensions are set
-    data = data.rio.set_spatial_dims(x_dim='x', y_dim='y', inplace=False)
-
-    # Read shapefiles
-    shp = gpd.read_file(path_clip_shp).to_crs(data.rio.crs)
-    basin_shp = gpd.read_file(path_basin_shp).to_crs("EPSG:4326")
-
-    # Clip data
-    clipped_data = data.rio.clip(shp.geometry, shp.crs).rio.reproject(projected_crs)
-
-    # Resample data
-    resolution = 2000
-    transform, width, height = calculate_default_transform(
-        clipped_data.rio.crs,
-        clipped_data.rio.crs,
-        clipped_data.rio.width,
-        clipped_data.rio.height,
-        *clipped_data.rio.bounds(),
-        resolution=(resolution, resolution),
-    )
+    data = dataset if dataset is not None else open_rain_dataset(data_file)
+
+    # Read shapefiles and the clip mask on the source grid from the geometry cache
+    cache_folder = shared_config.get("cache_folder", "data/cache")
+    shp = read_geometry(path_clip_shp, "EPSG:4326", cache_folder)
+    basin_shp = read_geometry(path_basin_shp, "EPSG:4326", cache_folder)
+    xs, ys = data["x"].values, data["y"].values
+    mask = grid_mask(path_clip_shp, "EPSG:4326", coords_transform(xs, ys), (len(ys), len(xs)), cache_folder)
+
+    # Clip data, then warp once straight onto the lat/lon display grid
+    clipped_data = clip_to_mask(data, mask)
+    transform, shape = display_grid(model_name, clipped_data, projected_crs)
     resampled_data = clipped_data.rio.reproject(
-        clipped_data.rio.crs,
-        shape=(height, width),
+        "EPSG:4326",
+        shape=shape,
         transform=transform,
         resampling=Resampling.bilinear,
-    ).rio.reproject("EPSG:4326")
+    )
 
     extent = [shp.total_bounds[0], shp.total_bounds[2], shp.total_bounds[1], shp.total_bounds[3]]
 
-    create_animation(resampled_data, f"Rainfall Prediction over {model_name}", save_path, extent, basin_shp, cmap, norm, logger)
+    create_animation(resampled_data, f"Rainfall Prediction over {model_name}", save_path, extent, basin_shp, cmap, norm, logger,
+                     workers=shared_config.get("animation_workers"), output_format=output_format)
 
 
 def main():
@@ -0,0 +1,155 @@
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+import xarray as xr
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from geometry_cache import read_geometry
+from rain_cache import (DEFAULT_FOLDER, cache_path, cached_file, info_path, model_shapefiles,
+                        source_signature, write_cache_info)
+from shapefiles import shapefile_digest
+
+
+# Spatial chunk edge in cells; every chunk holds the full time series
+CHUNK_CELLS = 16
+COMPRESSION_LEVEL = 4
+
+
+def load_config(config_path="shared/config.yaml"):
+    """Load configuration from a YAML file."""
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)
+
+
+def setup_logger(log_file="logs/crop_ecmwf.log"):
+    """Set up a logger."""
+    log_dir = os.path.dirname(log_file)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    return logging.getLogger()
+
+
+def all_shapefiles(config):
+    """Every clip and basin shapefile of the configured models, once each."""
+    shp_paths = []
+    for model_config in config["models"].values():
+        for shp_path in model_shapefiles(model_config):
+            if shp_path not in shp_paths:
+                shp_paths.append(shp_path)
+    return shp_paths
+
+
+def crop_bounds(shp_paths, margin, cache_folder):
+    """Union bounding box ``(west, south, east, north)`` of the shapefiles in EPSG:4326, plus a margin in degrees."""
+    bounds = np.array([read_geometry(shp_path, "EPSG:4326", cache_folder).total_bounds for shp_path in shp_paths])
+    return (bounds[:, 0].min() - margin, bounds[:, 1].min() - margin,
+            bounds[:, 2].max() + margin, bounds[:, 3].max() + margin)
+
+
+def coordinate_slice(values, low, high):
+    """Index range of the coordinate values within ``[low, high]``, for ascending or descending axes."""
+    inside = np.flatnonzero((values >= low) & (values <= high))
+    if not len(inside):
+        raise ValueError(f"No grid coordinate between {low} and {high}.")
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
+def write_cropped(raw_path, out_path, bounds):
+    """Crop a raw ECMWF file to ``bounds`` and write it as compressed NetCDF4.
+
+    Values are copied still packed, with their fill value, scale and units,
+    so readers decode them exactly as the raw file. Gridded variables are
+    chunked as the full time series of ``CHUNK_CELLS`` x ``CHUNK_CELLS``
+    tiles, so reading a few cells touches a few small chunks. Returns the
+    ``(lat, lon)`` offset of the crop in the full grid.
+    """
+    west, south, east, north = bounds
+    with xr.open_dataset(raw_path, mask_and_scale=False, decode_times=False) as data:
+        lat_name = "lat" if "lat" in data.dims else "latitude"
+        lon_name = "lon" if "lon" in data.dims else "longitude"
+        lat_slice = coordinate_slice(data[lat_name].values, south, north)
+        lon_slice = coordinate_slice(data[lon_name].values, west, east)
+        cropped = data.isel({lat_name: lat_slice, lon_name: lon_slice})
+
+        encoding = {}
+        for name, variable in cropped.data_vars.items():
+            encoding[name] = {"zlib": True, "complevel": COMPRESSION_LEVEL, "shuffle": True}
+            if lat_name in variable.dims and lon_name in variable.dims:
+                encoding[name]["chunksizes"] = tuple(
+                    min(CHUNK_CELLS, size) if dim in (lat_name, lon_name) else size
+                    for dim, size in variable.sizes.items()
+                )
+
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        cropped.to_netcdf(tmp_path, format="NETCDF4", encoding=encoding)
+
+    os.replace(tmp_path, out_path)
+    return lat_slice.start, lon_slice.start
+
+
+def update_cache(raw_path, config, logger):
+    """Write the basin-cropped copy of a raw file unless a current one exists. Returns its path."""
+    shared_config = config["shared"]
+    ecmwf_cache = shared_config.get("ecmwf_cache", DEFAULT_FOLDER)
+    shp_paths = all_shapefiles(config)
+
+    path = cached_file(raw_path, ecmwf_cache, shp_paths)
+    if path:
+        return path
+
+    path = cache_path(raw_path, ecmwf_cache)
+    bounds = crop_bounds(shp_paths, shared_config.get("ecmwf_cache_margin", 0.5), shared_config.get("cache_folder", "data/cache"))
+    signature = source_signature(raw_path)
+
+    # Drop the old sidecar first, so no reader pairs it with the new file
+    if os.path.exists(info_path(path)):
+        os.remove(info_path(path))
+    lat_offset, lon_offset = write_cropped(raw_path, path, bounds)
+    write_cache_info(path, {
+        "source": os.path.abspath(raw_path),
+        "source_signature": signature,
+        "shapefiles": {os.path.abspath(shp_path): shapefile_digest(shp_path) for shp_path in shp_paths},
+        "bounds": [float(value) for value in bounds],
+        "lat_offset": lat_offset,
+        "lon_offset": lon_offset,
+    })
+
+    raw_size, cropped_size = os.path.getsize(raw_path), os.path.getsize(path)
+    logger.info(f"Cropped {raw_path} to {path}: {raw_size / 1e6:.1f} MB -> {cropped_size / 1e6:.2f} MB")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write basin-cropped copies of raw ECMWF files to the cache.")
+    parser.add_argument("files", nargs="*", help="raw files to crop (default: every file in the raw folder)")
+    args = parser.parse_args()
+
+    config = load_config()
+    logger = setup_logger()
+    raw_folder = config["shared"].get("raw_folder", "data/raw")
+    files = args.files or sorted(
+        os.path.join(raw_folder, name) for name in os.listdir(raw_folder)
+        if name.startswith("ECMWF_") and name.endswith(".nc")
+    )
+
+    failed = 0
+    for raw_path in files:
+        try:
+            update_cache(raw_path, config, logger)
+        except Exception as e:
+            logger.error(f"Failed to crop {raw_path}: {e}")
+            failed += 1
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+
+
+SKIP = "skip"
+FETCH = "fetch"
+REFETCH = "refetch"
+REPAIR = "repair"
+ADOPT = "adopt"
+
+
+def file_checksum(file_path, block_size=1024 * 1024):
+    """Compute the SHA-256 checksum of a local file."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """Persistent record of downloaded files and the remote metadata they were fetched from."""
+
+    def __init__(self, manifest_path):
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        self.conn = sqlite3.connect(manifest_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS downloads (
+                file_name TEXT PRIMARY KEY,
+                remote_size INTEGER,
+                remote_mtime TEXT,
+                local_size INTEGER,
+                local_mtime REAL,
+                checksum TEXT,
+                download_seconds REAL,
+                downloaded_at TEXT
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, file_name):
+        """Return the manifest entry for a file, or None."""
+        return self.conn.execute("SELECT * FROM downloads WHERE file_name = ?", (file_name,)).fetchone()
+
+    def record(self, file_name, local_path, remote_size, remote_mtime, download_seconds=None):
+        """Store the metadata of a complete local copy."""
+        stat = os.stat(local_path)
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO downloads
+                (file_name, remote_size, remote_mtime, local_size, local_mtime, checksum, download_seconds, downloaded_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                file_name,
+                remote_size,
+                remote_mtime,
+                stat.st_size,
+                stat.st_mtime,
+                file_checksum(local_path),
+                download_seconds,
+                datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+        self.conn.commit()
+
+    def plan(self, file_name, local_path, remote_size, remote_mtime, verify_checksum=False):
+        """Decide what to do with a remote file using only cheap metadata comparisons.
+
+        Returns one of ``SKIP``, ``FETCH``, ``REFETCH``, ``REPAIR`` or ``ADOPT``.
+        The local file is hashed only when ``verify_checksum`` is set or when
+        its size or mtime no longer matches the manifest. Metadata the server
+        does not report (None) is not compared, so an existing local copy is
+        kept rather than downloaded again.
+        """
+        entry = self.get(file_name)
+
+        if not os.path.exists(local_path):
+            return FETCH
+
+        stat = os.stat(local_path)
+        if entry is None:
+            # Copy from before the manifest existed: keep it if it is complete.
+            if remote_size is None or stat.st_size == remote_size:
+                return ADOPT
+            return REPAIR if stat.st_size < remote_size else REFETCH
+
+        if (None not in (remote_size, entry["remote_size"]) and remote_size != entry["remote_size"]) or (
+            None not in (remote_mtime, entry["remote_mtime"]) and remote_mtime != entry["remote_mtime"]
+        ):
+            return REFETCH
+
+        if stat.st_size != entry["local_size"] or stat.st_mtime != entry["local_mtime"] or verify_checksum:
+            if entry["remote_size"] is not None and stat.st_size < entry["remote_size"]:
+                return REPAIR
+            if file_checksum(local_path) != entry["checksum"]:
+                return REFETCH
+            self.conn.execute(
+                "UPDATE downloads SET local_size = ?, local_mtime = ? WHERE file_name = ?",
+                (stat.st_size, stat.st_mtime, file_name),
+            )
+            self.conn.commit()
+
+        return SKIP
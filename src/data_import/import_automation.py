@@ -1,9 +1,22 @@
 import os
+import re
+import sys
 import logging
+import argparse
+import threading
 import yaml
 from datetime import datetime, timedelta
-from mil.army.usace.hec.vortex.io import BatchImporter
-from mil.army.usace.hec.vortex.geo import WktFactory
+from Queue import Queue, Empty
+from java.nio.file import FileSystems, Paths, StandardWatchEventKinds
+from java.util.concurrent import TimeUnit
+from mil.army.usace.hec.vortex.io import DataReader, DataWriter
+from mil.army.usace.hec.vortex.geo import ResamplingMethod, Resampler, VectorUtils, WktFactory
+from regrid_weights import apply_weights, load_or_build_weights, regrid_mismatches
+from scenarios import apply_scenario, scenario_part_f
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from state_store import file_signature, open_state_store
+from rain_cache import DEFAULT_FOLDER, model_shapefiles, preferred_file
 
 
 def load_config(config_path="shared/config.yaml"):
@@ -30,77 +43,51 @@ def setup_logger(log_file):
     return logging.getLogger()
 
 
-def load_processed_dates(log_file):
-    """Load processed dates from a log file."""
-    if os.path.exists(log_file):
-        with open(log_file, "r") as f:
-            return set(line.strip() for line in f.readlines())
-    return set()
-
+RAW_FILE_PATTERN = re.compile(r"^ECMWF_new_3d\.0125\.(\d{8})(1200|0000)\.PREC\.nc$")
 
-def save_processed_dates(log_file, processed_dates):
-    """Save processed dates to a log file."""
-    with open(log_file, "w") as f:
-        for date in sorted(processed_dates):
-            f.write("{}\n".format(date))
+IMPORT_STAGE = "import"
+SCENARIO_IMPORT_STAGE = "scenario_import"
 
+_destination_locks = {}
+_destination_locks_guard = threading.Lock()
 
-def import_data_for_model(model_name, model_config, shared_config, processed_dates):
-    """Import data for a specific model based on its configuration."""
-    log_file = model_config["log_file"]
-    clip_shp = model_config["clip_shp"]
-    destination = model_config["destination"]
-    targetWkt = model_config["targetWkt"]
-    partA = model_config["partA"]
-
-    # Set up logging
-    logger = setup_logger(log_file)
 
-    # Determine the date to process (yesterday's date)
-    now = datetime.now()
-    date_to_process = (now - timedelta(days=1)).date()
-    date_str = date_to_process.strftime('%Y%m%d')
+def destination_lock(destination):
+    """Return the lock that serialises writes to a DSS file."""
+    key = os.path.normcase(os.path.abspath(destination))
+    with _destination_locks_guard:
+        return _destination_locks.setdefault(key, threading.Lock())
 
-    if date_str in processed_dates:
-        logger.info("Data for date {} has already been processed.".format(date_str))
-        return
 
-    # Locate raw files
-    raw_folder = shared_config.get("raw_folder", "data/raw")
+def find_data_file(raw_folder, date_str, logger):
+    """Locate the ECMWF NetCDF file for a date in the raw folder."""
     file_patterns = [
         "ECMWF_new_3d.0125.{date}1200.PREC.nc",
         "ECMWF_new_3d.0125.{date}0000.PREC.nc",
     ]
-    data_file = None
     for pattern in file_patterns:
         file_path = os.path.abspath(os.path.join(raw_folder, pattern.format(date=date_str)))
         logger.info("Checking file: {}".format(file_path))
         if os.path.exists(file_path):
-            data_file = file_path
             logger.info("Found data file: {}".format(file_path))
-            break
-
-    if not data_file:
-        current_time = now.time()
-        cutoff_time = datetime.strptime(shared_config["data_cutoff_time"], "%H:%M").time()
+            return file_path
+    return None
 
-        if current_time >= cutoff_time:
-            logger.warning("No data files available for date {} by cutoff time {}.".format(date_str, cutoff_time))
-        else:
-            logger.info("Data for date {} not available yet. Will retry later.".format(date_str))
-        return
 
-    # Build and execute BatchImporter
-    variables = ['rain']
-    geo_options = {
-        "pathToShp": clip_shp,
+def build_geo_options(model_config):
+    """Build the Vortex geo options for a model."""
+    return {
+        "pathToShp": model_config["clip_shp"],
         "targetCellSize": "2000",
-        "targetWkt": WktFactory.fromEpsg(targetWkt),
+        "targetWkt": WktFactory.fromEpsg(model_config["targetWkt"]),
         "resamplingMethod": "Bilinear",
     }
 
-    write_options = {
-        "partA": partA,
+
+def build_write_options(model_name, model_config):
+    """Build the DSS write options for a model."""
+    return {
+        "partA": model_config["partA"],
         "partB": model_name.upper(),
         "partC": "PRECIPITATION",
         "partF": "ECMWF",
@@ -108,37 +95,478 @@ def import_data_for_model(model_name, model_config, shared_config, processed_dat
         "units": "mm",
     }
 
-    try:
-        my_import = BatchImporter.builder() \
-            .inFiles([data_file]) \
-            .variables(variables) \
-            .geoOptions(geo_options) \
-            .destination(destination) \
-            .writeOptions(write_options) \
+
+def read_source_grids(data_file, variables):
+    """Read every time step of the source NetCDF once."""
+    grids = []
+    for variable in variables:
+        reader = DataReader.builder().path(data_file).variable(variable).build()
+        grids.extend(reader.getDtos())
+    return grids
+
+
+def vortex_regrid(grids, geo_options):
+    """Clip and resample source grids with Vortex's own Resampler."""
+    clip_path = Paths.get(geo_options["pathToShp"])
+    envelope = VectorUtils.getEnvelope(clip_path)
+    envelope_wkt = VectorUtils.getWkt(clip_path)
+    method = ResamplingMethod.fromString(geo_options["resamplingMethod"])
+
+    resampled = []
+    for grid in grids:
+        resampled.append(
+            Resampler.builder()
+            .grid(grid)
+            .envelope(envelope)
+            .envelopeWkt(envelope_wkt)
+            .targetWkt(geo_options["targetWkt"])
+            .cellSize(float(geo_options["targetCellSize"]))
+            .method(method)
             .build()
-        my_import.process()
-        logger.info("Data import and DSS creation complete for date {}.".format(date_str))
+            .resample()
+        )
+    return resampled
+
+
+def check_regrid(grids, geo_options, regrid, tolerance):
+    """Compare the cached-weights regrid of one time step with Vortex's Resampler.
+
+    The middle time step is used, as the first one is often all zeros.
+    Returns the mismatches found (origin, dimensions, values beyond
+    ``tolerance``), empty when both paths agree.
+    """
+    grid = grids[len(grids) // 2]
+    return regrid_mismatches(vortex_regrid([grid], geo_options)[0], apply_weights(regrid, grid), tolerance)
+
+
+def regrid_for_model(grids, geo_options, shared_config, logger):
+    """Clip and resample already-decoded source grids onto a model's target grid.
+
+    With ``regrid_method: "weights"`` the bilinear weights, which only
+    depend on the geometry, are cached on disk and each time step is
+    regridded with a single sparse mat-vec. One time step is checked against
+    Vortex's Resampler first, and Vortex is used for every step if they
+    disagree. ``regrid_method: "vortex"`` always uses Vortex.
+    """
+    if shared_config.get("regrid_method", "weights") == "vortex":
+        return vortex_regrid(grids, geo_options)
+
+    regrid = load_or_build_weights(grids[0], geo_options, shared_config.get("cache_folder", "data/cache"), logger)
+    mismatches = check_regrid(grids, geo_options, regrid, shared_config.get("regrid_tolerance", 0.01))
+    if mismatches:
+        logger.error("Regrid weights disagree with Vortex ({}), using Vortex.".format("; ".join(mismatches)))
+        return vortex_regrid(grids, geo_options)
+    return [apply_weights(regrid, grid) for grid in grids]
+
 
-        processed_dates.add(date_str)
-        save_processed_dates(model_config["processed_dates_log"], processed_dates)
+def write_grids(grids, destination, write_options):
+    """Write resampled grids to a DSS file."""
+    writer = DataWriter.builder() \
+        .data(grids) \
+        .destination(Paths.get(destination)) \
+        .options(write_options) \
+        .build()
+    writer.write()
 
+
+def import_grids_for_model(model_name, model_config, grids, data_file, date_str, shared_config, logger):
+    """Regrid decoded source grids for one model and write them to its DSS file.
+
+    Returns True on success. Errors are logged rather than raised so one
+    basin cannot stop the others sharing the same source grid.
+    """
+    geo_options = build_geo_options(model_config)
+    write_options = build_write_options(model_name, model_config)
+
+    try:
+        resampled = regrid_for_model(grids, geo_options, shared_config, logger)
+        with destination_lock(model_config["destination"]):
+            write_grids(resampled, model_config["destination"], write_options)
+        logger.info("Data import and DSS creation complete for date {}.".format(date_str))
+        return True
     except Exception as e:
         logger.error("Error during data import for file {}: {}".format(data_file, e))
         logger.error("Geo options: {}".format(geo_options))
         logger.error("Write options: {}".format(write_options))
+        return False
+
+
+def import_file_for_models(models, model_names, data_file, date_str, shared_config, state, loggers):
+    """Decode one raw file and import it for the given models, recording each outcome.
+
+    Each model's import is claimed in the state store first, so a model
+    another process is already importing for this date is left to it. The
+    basin-cropped copy of ``data_file`` is decoded when the cache has a
+    current one covering these models. Returns the names of the models whose
+    import failed.
+    """
+    input_hash = file_signature(data_file)
+    claimed = []
+    for model_name in model_names:
+        if state.claim(IMPORT_STAGE, model_name, date_str, input_hash):
+            claimed.append(model_name)
+        else:
+            loggers[model_name].info("Import of date {} is done or claimed by another worker.".format(date_str))
+    if not claimed:
+        return []
+
+    shp_paths = [shp_path for model_name in claimed for shp_path in model_shapefiles(models[model_name])]
+    source_file = preferred_file(data_file, shared_config.get("ecmwf_cache", DEFAULT_FOLDER), shp_paths)
+    try:
+        grids = read_source_grids(source_file, ['rain'])
+    except Exception as e:
+        for model_name in claimed:
+            state.fail(IMPORT_STAGE, model_name, date_str, e)
+        raise
+
+    failed = []
+    for model_name in claimed:
+        model_config = models[model_name]
+        if import_grids_for_model(model_name, model_config, grids, data_file, date_str, shared_config, loggers[model_name]):
+            state.complete(IMPORT_STAGE, model_name, date_str)
+        else:
+            state.fail(IMPORT_STAGE, model_name, date_str)
+            failed.append(model_name)
+    return failed
+
+
+def import_data_for_models(models, shared_config, state):
+    """Import yesterday's data for several models from a single read of the source grid.
+
+    The ECMWF NetCDF is decoded once and the in-memory grids are clipped and
+    resampled for each model in turn, so adding a basin costs one regrid and
+    one DSS write rather than another full decode of the source file.
+    Imports already done are looked up in the ``state`` store.
+    """
+    # Determine the date to process (yesterday's date)
+    now = datetime.now()
+    date_to_process = (now - timedelta(days=1)).date()
+    date_str = date_to_process.strftime('%Y%m%d')
+
+    loggers = {}
+    pending = []
+    for model_name, model_config in models.items():
+        logger = setup_logger(model_config["log_file"])
+        loggers[model_name] = logger
+        if state.is_done(IMPORT_STAGE, model_name, date_str):
+            logger.info("Data for date {} has already been processed.".format(date_str))
+        else:
+            pending.append(model_name)
+
+    if not pending:
+        return
+
+    # Locate raw files
+    raw_folder = shared_config.get("raw_folder", "data/raw")
+    data_file = find_data_file(raw_folder, date_str, loggers[pending[0]])
+
+    if not data_file:
+        current_time = now.time()
+        cutoff_time = datetime.strptime(shared_config["data_cutoff_time"], "%H:%M").time()
+
+        for model_name in pending:
+            if current_time >= cutoff_time:
+                loggers[model_name].warning("No data files available for date {} by cutoff time {}.".format(date_str, cutoff_time))
+            else:
+                loggers[model_name].info("Data for date {} not available yet. Will retry later.".format(date_str))
+        return
+
+    failed = import_file_for_models(models, pending, data_file, date_str, shared_config, state, loggers)
+    if failed:
+        raise RuntimeError("Data import failed for models: {}".format(", ".join(failed)))
+
+
+def import_raw_file(models, model_names, data_file, shared_config, state):
+    """Import one given raw file for ``model_names`` (all models by default) that have not imported its date.
+
+    Used by the pipeline daemon, which crops the file into the cache before
+    calling, so the models' import decodes that cropped copy.
+    """
+    match = RAW_FILE_PATTERN.match(os.path.basename(data_file))
+    if not match:
+        raise ValueError("Not an ECMWF raw file name: {}".format(data_file))
+    date_str = match.group(1)
+    loggers = dict((name, setup_logger(models[name]["log_file"])) for name in models)
+    pending = [name for name in sorted(model_names or models) if not state.is_done(IMPORT_STAGE, name, date_str)]
+    if not pending:
+        return
+    failed = import_file_for_models(models, pending, os.path.abspath(data_file), date_str, shared_config, state, loggers)
+    if failed:
+        raise RuntimeError("Data import failed for models: {}".format(", ".join(failed)))
+
+
+def check_regrid_for_models(models, shared_config, data_file=None):
+    """Compare the cached-weights regrid with Vortex's Resampler for every model.
+
+    Uses ``data_file`` or yesterday's raw file. Returns the names of the
+    models whose grids disagree.
+    """
+    logger = logging.getLogger()
+    if data_file is None:
+        date_str = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+        data_file = find_data_file(shared_config.get("raw_folder", "data/raw"), date_str, logger)
+        if not data_file:
+            raise RuntimeError("No data file available for date {}.".format(date_str))
+
+    grids = read_source_grids(data_file, ['rain'])
+    tolerance = shared_config.get("regrid_tolerance", 0.01)
+    failed = []
+    for model_name in sorted(models):
+        geo_options = build_geo_options(models[model_name])
+        regrid = load_or_build_weights(grids[0], geo_options, shared_config.get("cache_folder", "data/cache"), logger)
+        mismatches = check_regrid(grids, geo_options, regrid, tolerance)
+        if mismatches:
+            failed.append(model_name)
+            print("{}: {}".format(model_name, "; ".join(mismatches)))
+        else:
+            print("{}: regrid weights match Vortex within {}".format(model_name, tolerance))
+    return failed
+
+
+def import_data_for_model(model_name, model_config, shared_config, state):
+    """Import data for a specific model based on its configuration."""
+    import_data_for_models({model_name: model_config}, shared_config, state)
+
+
+def import_scenarios_for_models(models, shared_config, state):
+    """Write precipitation scenario variants of yesterday's data for models with ``scenarios``.
+
+    The source grid is decoded once and regridded once per model; each
+    scenario is then a cheap perturbation of the regridded grids, written to
+    the model's DSS file under its own part F. Each model's scenario import
+    is claimed and recorded in the ``state`` store, which the scenario
+    forecasts check before computing.
+    """
+    logger = logging.getLogger()
+    date_str = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+    scenario_models = dict((name, config) for name, config in models.items() if config.get("scenarios"))
+    if not scenario_models:
+        logger.info("No scenarios configured.")
+        return
+
+    data_file = find_data_file(shared_config.get("raw_folder", "data/raw"), date_str, logger)
+    if not data_file:
+        raise RuntimeError("No data file available for date {}.".format(date_str))
+
+    input_hash = file_signature(data_file)
+    claimed = [name for name in sorted(scenario_models) if state.claim(SCENARIO_IMPORT_STAGE, name, date_str, input_hash)]
+    if not claimed:
+        logger.info("Scenarios for date {} are done or claimed by another worker.".format(date_str))
+        return
+
+    shp_paths = [shp_path for model_name in claimed for shp_path in model_shapefiles(models[model_name])]
+    try:
+        grids = read_source_grids(preferred_file(data_file, shared_config.get("ecmwf_cache", DEFAULT_FOLDER), shp_paths), ['rain'])
+    except Exception as e:
+        for model_name in claimed:
+            state.fail(SCENARIO_IMPORT_STAGE, model_name, date_str, e)
         raise
 
+    failed = []
+    for model_name in claimed:
+        model_config = scenario_models[model_name]
+        logger = setup_logger(model_config["log_file"])
+        try:
+            resampled = regrid_for_model(grids, build_geo_options(model_config), shared_config, logger)
+            for scenario in model_config["scenarios"]:
+                write_options = build_write_options(model_name, model_config)
+                write_options["partF"] = scenario_part_f(scenario, write_options["partF"])
+                with destination_lock(model_config["destination"]):
+                    write_grids(apply_scenario(resampled, scenario), model_config["destination"], write_options)
+                logger.info("Scenario {} written for date {} with part F {}.".format(
+                    scenario["name"], date_str, write_options["partF"]))
+        except Exception as e:
+            logger.error("Scenario import failed for date {}: {}".format(date_str, e))
+            state.fail(SCENARIO_IMPORT_STAGE, model_name, date_str, e)
+            failed.append(model_name)
+        else:
+            state.complete(SCENARIO_IMPORT_STAGE, model_name, date_str)
+
+    if failed:
+        raise RuntimeError("Scenario import failed for models: {}".format(", ".join(failed)))
+
+
+def scan_raw_files(raw_folder):
+    """Map each date in the raw folder to its data file, preferring the 12:00 run."""
+    raw_files = {}
+    for file_name in sorted(os.listdir(raw_folder)):
+        match = RAW_FILE_PATTERN.match(file_name)
+        if not match:
+            continue
+        date_str, run = match.groups()
+        if date_str not in raw_files or run == "1200":
+            raw_files[date_str] = os.path.abspath(os.path.join(raw_folder, file_name))
+    return raw_files
+
+
+def find_missing_imports(models, raw_files, state):
+    """List (date, data file, model names) for every raw date pending import for a model."""
+    pending = state.pending(IMPORT_STAGE, [(name, date_str) for date_str in sorted(raw_files) for name in sorted(models)])
+    model_names = {}
+    for name, date_str in pending:
+        model_names.setdefault(date_str, []).append(name)
+    return [(date_str, raw_files[date_str], model_names[date_str]) for date_str in sorted(model_names)]
+
+
+def backfill(models, shared_config, state, workers):
+    """Import every raw date pending in the state store on a pool of worker threads.
+
+    Each task decodes one date's source file once and fans it out to the
+    models that still need it. Writes to the same DSS destination are
+    serialised by a per-destination lock, so dates for one model can be
+    regridded in parallel without two writers touching the same file.
+    """
+    logger = logging.getLogger()
+    raw_folder = shared_config.get("raw_folder", "data/raw")
+    loggers = dict((name, setup_logger(config["log_file"])) for name, config in models.items())
+
+    tasks = find_missing_imports(models, scan_raw_files(raw_folder), state)
+    if not tasks:
+        logger.info("Backfill: all raw dates have been imported.")
+        return
+
+    logger.info("Backfill: {} dates to import with {} workers.".format(len(tasks), workers))
+    queue = Queue()
+    for task in tasks:
+        queue.put(task)
+
+    failures = []
+
+    def worker():
+        while True:
+            try:
+                date_str, data_file, model_names = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                failed = import_file_for_models(models, model_names, data_file, date_str, shared_config, state, loggers)
+            except Exception as e:
+                logger.error("Error reading {}: {}".format(data_file, e))
+                failed = model_names
+            failures.extend((name, date_str) for name in failed)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, len(tasks)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if failures:
+        raise RuntimeError("Backfill failed for: {}".format(
+            ", ".join("{} {}".format(name, date_str) for name, date_str in sorted(failures))))
+    logger.info("Backfill complete.")
+
+
+def watch_raw_folder(models, shared_config, state, poll_seconds):
+    """Import each ECMWF file as soon as it lands in the raw folder.
+
+    The FTP download renames a file into place only once it is complete, so
+    a new name matching ``RAW_FILE_PATTERN`` is imported right away for the
+    models that have not imported its date. When no event arrives for
+    ``poll_seconds`` (or events were dropped), the regular check of
+    yesterday's file runs as a fallback.
+    """
+    logger = logging.getLogger()
+    raw_folder = shared_config.get("raw_folder", "data/raw")
+    loggers = dict((name, setup_logger(config["log_file"])) for name, config in models.items())
+
+    watcher = FileSystems.getDefault().newWatchService()
+    Paths.get(raw_folder).register(watcher, StandardWatchEventKinds.ENTRY_CREATE, StandardWatchEventKinds.ENTRY_MODIFY)
+    logger.info("Watching {} for new ECMWF files.".format(raw_folder))
+    try:
+        while True:
+            key = watcher.poll(poll_seconds, TimeUnit.SECONDS)
+            events = [] if key is None else list(key.pollEvents())
+            if key is not None:
+                key.reset()
+
+            if key is None or any(event.kind() == StandardWatchEventKinds.OVERFLOW for event in events):
+                try:
+                    import_data_for_models(models, shared_config, state)
+                except Exception as e:
+                    logger.error("Fallback import failed: {}".format(e))
+                continue
+
+            for file_name in sorted(set(str(event.context()) for event in events)):
+                match = RAW_FILE_PATTERN.match(file_name)
+                if not match:
+                    continue
+                date_str = match.group(1)
+                model_names = [name for name in sorted(models) if not state.is_done(IMPORT_STAGE, name, date_str)]
+                if not model_names:
+                    continue
+                logger.info("New raw file {}: importing date {} for {}.".format(file_name, date_str, ", ".join(model_names)))
+                data_file = os.path.abspath(os.path.join(raw_folder, file_name))
+                try:
+                    failed = import_file_for_models(models, model_names, data_file, date_str, shared_config, state, loggers)
+                except Exception as e:
+                    logger.error("Error reading {}: {}".format(data_file, e))
+                    continue
+                if failed:
+                    logger.error("Import of {} failed for models: {}".format(file_name, ", ".join(failed)))
+    finally:
+        watcher.close()
+
+
+def serve(description):
+    """Keep the JVM and the Vortex classes loaded and run once per line read from stdin.
+
+    Each line holds the command-line arguments of one run (empty for the
+    daily run). After each run ``DONE <exit code>`` is written to stdout, so
+    the pipeline daemon can reuse this process for every cycle.
+    """
+    for line in iter(sys.stdin.readline, ""):
+        code = 0
+        try:
+            main(line.split())
+        except SystemExit as e:
+            code = e.code or 0
+        except Exception:
+            logging.getLogger().exception("{} run failed: {}".format(description, line.strip()))
+            code = 1
+        sys.stdout.write("DONE {}\n".format(code))
+        sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import ECMWF rainfall into the HEC-HMS DSS files.")
+    parser.add_argument("--backfill", action="store_true", help="import every date in the raw folder not imported yet")
+    parser.add_argument("--workers", type=int, help="number of parallel backfill workers")
+    parser.add_argument("--scenarios", action="store_true", help="write the configured precipitation scenarios for yesterday")
+    parser.add_argument("--file", help="import this raw file instead of looking up yesterday's")
+    parser.add_argument("--check-regrid", action="store_true", help="compare the regrid weights with Vortex's resampler and exit")
+    parser.add_argument("--models", nargs="+", help="with --file, only import these models")
+    parser.add_argument("--serve", action="store_true", help="stay resident and run once per line read from stdin")
+    parser.add_argument("--watch", action="store_true", help="import each raw file as soon as it arrives")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve("Import")
+        return
 
-def main():
     # Load configuration
     config = load_config("config.yaml")
 
     models = config["models"]
     shared_config = config["shared"]
 
-    for model_name, model_config in models.items():
-        processed_dates = load_processed_dates(model_config["processed_dates_log"])
-        import_data_for_model(model_name, model_config, shared_config, processed_dates)
+    if args.check_regrid:
+        sys.exit(1 if check_regrid_for_models(models, shared_config, args.file) else 0)
+
+    state = open_state_store(config)
+    try:
+        if args.scenarios:
+            import_scenarios_for_models(models, shared_config, state)
+        elif args.file:
+            import_raw_file(models, args.models, args.file, shared_config, state)
+        elif args.watch:
+            watch_raw_folder(models, shared_config, state, shared_config.get("watch_poll_seconds", 300))
+        elif args.backfill:
+            backfill(models, shared_config, state, args.workers or shared_config.get("import_workers", 4))
+        else:
+            import_data_for_models(models, shared_config, state)
+    finally:
+        state.close()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import ftplib
 import os
 import logging
+import time
 import yaml
 
+from ftp_manifest import ADOPT, REFETCH, REPAIR, SKIP, DownloadManifest
+from crop_ecmwf import update_cache
+
 load_dotenv()
 
 def load_config(config_path="shared/config.yaml"):
@@ -26,76 +31,239 @@ def setup_logger(log_file="logs/ftp_download.log"):
     )
     return logging.getLogger("FTPDownloader")
 
+def connect_ftp(ftp_config):
+    """Open an FTP session positioned in the remote directory."""
+    ftp = ftplib.FTP(ftp_config["server"], timeout=ftp_config.get("timeout", 60))
+    ftp.login(user=ftp_config["username"], passwd=ftp_config["password"])
+    ftp.cwd(ftp_config["remote_directory"])
+    return ftp
+
+
+def close_ftp(ftp):
+    """Close an FTP session, dropping the socket if QUIT fails."""
+    try:
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+
+def download_file(ftp_config, file_name, logger):
+    """Download a single file on its own FTP session, resuming and retrying on failure.
+
+    Data is written to ``<file>.part`` and renamed into place only once the
+    transfer is complete, so a killed run never leaves a truncated ``.nc``
+    behind. A leftover ``.part`` file is resumed with a ``REST`` offset; if
+    the server rejects ``REST`` the file is downloaded again from the start.
+    A 550 reply (no such file, no access) gives up at once, other errors are
+    retried. Returns the transfer time in seconds, or None if the download
+    failed.
+    """
+    local_file_path = os.path.join(ftp_config["local_directory"], file_name)
+    partial_path = local_file_path + ".part"
+    max_retries = ftp_config.get("max_retries", 3)
+    retry_backoff = ftp_config.get("retry_backoff", 5)
+
+    started = time.monotonic()
+    for attempt in range(1, max_retries + 1):
+        ftp = None
+        try:
+            ftp = connect_ftp(ftp_config)
+            ftp.voidcmd("TYPE I")
+            remote_size = remote_size_or_none(ftp, file_name)
+
+            offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            if remote_size is not None and offset > remote_size:
+                logger.warning(f"Discarding stale partial file for {file_name}")
+                offset = 0
+            if offset:
+                try:
+                    ftp.sendcmd(f"REST {offset}")
+                except ftplib.error_perm as e:
+                    logger.warning(f"Server cannot resume {file_name} ({e}), downloading it from the start")
+                    os.remove(partial_path)
+                    offset = 0
+            if offset:
+                logger.info(f"Resuming {file_name} from byte {offset}")
+
+            with open(partial_path, "ab" if offset else "wb") as local_file:
+                if remote_size is None or offset < remote_size:
+                    ftp.retrbinary(f"RETR {file_name}", local_file.write, rest=offset or None)
+
+            local_size = os.path.getsize(partial_path)
+            if remote_size is not None and local_size != remote_size:
+                raise IOError(f"Incomplete transfer: {local_size} of {remote_size} bytes")
+
+            os.replace(partial_path, local_file_path)
+            logger.info(f"Downloaded: {file_name}")
+            return time.monotonic() - started
+        except Exception as e:
+            if isinstance(e, ftplib.error_perm) and str(e).startswith("550"):
+                logger.error(f"Error downloading file {file_name}: {e}")
+                return None
+            logger.warning(f"Attempt {attempt}/{max_retries} failed for {file_name}: {e}")
+            if attempt < max_retries:
+                time.sleep(retry_backoff * 2 ** (attempt - 1))
+        finally:
+            if ftp is not None:
+                close_ftp(ftp)
+
+    logger.error(f"Error downloading file {file_name}: giving up after {max_retries} attempts")
+    return None
+
+
+def list_remote_files(ftp, logger):
+    """Return ``{name: (size, mtime)}`` for the remote directory.
+
+    Uses a single ``MLSD`` listing when the server supports it; otherwise
+    falls back to ``NLST`` and leaves the metadata to be fetched per file.
+    """
+    try:
+        return {
+            name: (int(facts["size"]) if "size" in facts else None, facts.get("modify"))
+            for name, facts in ftp.mlsd(facts=["size", "modify"])
+            if facts.get("type", "file") == "file"
+        }
+    except ftplib.error_perm:
+        logger.info("MLSD not supported by server, falling back to NLST.")
+        return {name: (None, None) for name in ftp.nlst()}
+
+
+def remote_size_or_none(ftp, file_name):
+    """Size of a remote file, or None when the server does not support SIZE."""
+    try:
+        return ftp.size(file_name)
+    except ftplib.error_perm:
+        return None
+
+
+def remote_file_metadata(ftp, file_name, listing):
+    """Return (size, mtime) for a remote file, querying SIZE/MDTM when the listing lacks them.
+
+    Either value is None when the server does not support the command.
+    """
+    size, mtime = listing[file_name]
+    if size is None:
+        ftp.voidcmd("TYPE I")
+        size = remote_size_or_none(ftp, file_name)
+    if mtime is None:
+        try:
+            mtime = ftp.voidcmd(f"MDTM {file_name}").split()[-1]
+        except ftplib.error_perm:
+            mtime = None
+    return size, mtime
+
+
 def download_ftp_files(ftp_config, logger):
-    """Download files for the past 7 days and skip already downloaded files."""
+    """Download files for the past 7 days, skipping files whose manifest entry is still current.
+
+    Returns the local paths of the files now present.
+    """
     server = ftp_config["server"]
-    username = ftp_config["username"]
-    password = ftp_config["password"]
-    remote_directory = ftp_config["remote_directory"]
     local_directory = ftp_config["local_directory"]
+    max_connections = ftp_config.get("max_connections", 4)
+    verify_checksum = ftp_config.get("verify_checksum", False)
 
     if not os.path.exists(local_directory):
         os.makedirs(local_directory)
 
-    downloaded_files_log = "logs/downloaded_files.txt"
-
-    # Load previously downloaded files
-    if os.path.exists(downloaded_files_log):
-        with open(downloaded_files_log, "r") as f:
-            downloaded_files = set(f.read().splitlines())
-    else:
-        downloaded_files = set()
+    manifest = DownloadManifest(ftp_config.get("manifest", "logs/download_manifest.sqlite"))
 
     # Calculate the past 7 days
     today = datetime.now()
     date_list = [(today - timedelta(days=i)).strftime("%Y%m%d") for i in range(7)]
 
     try:
-        ftp = ftplib.FTP(server)
-        ftp.login(user=username, passwd=password)
+        ftp = connect_ftp(ftp_config)
         logger.info(f"Connected to FTP server: {server}")
+        listing = list_remote_files(ftp, logger)
 
-        ftp.cwd(remote_directory)
-
-        files = ftp.nlst()
-
+        remote_metadata = {}
         for date in date_list:
             preferred_file = f"ECMWF_new_3d.0125.{date}1200.PREC.nc"
             alternate_file = f"ECMWF_new_3d.0125.{date}0000.PREC.nc"
 
             for file_name in [preferred_file, alternate_file]:
-                if file_name in files:
-                    if file_name in downloaded_files:
-                        logger.info(f"Skipping already downloaded file: {file_name}")
-                        continue
-
-                    local_file_path = os.path.join(local_directory, file_name)
-                    try:
-                        with open(local_file_path, "wb") as local_file:
-                            ftp.retrbinary(f"RETR {file_name}", local_file.write)
-                        logger.info(f"Downloaded: {file_name}")
-                        downloaded_files.add(file_name)
-                    except Exception as e:
-                        logger.error(f"Error downloading file {file_name}: {e}")
+                if file_name in listing:
+                    remote_metadata[file_name] = remote_file_metadata(ftp, file_name, listing)
                 else:
                     logger.info(f"File not available on FTP: {file_name}")
-
-        with open(downloaded_files_log, "w") as f:
-            f.write("\n".join(downloaded_files))
-
-        ftp.quit()
-        logger.info("FTP connection closed.")
+        close_ftp(ftp)
     except Exception as e:
         logger.error(f"Error during FTP download: {e}")
+        manifest.close()
         raise
 
+    pending_files = []
+    for file_name, (remote_size, remote_mtime) in remote_metadata.items():
+        local_file_path = os.path.join(local_directory, file_name)
+        partial_path = local_file_path + ".part"
+        action = manifest.plan(file_name, local_file_path, remote_size, remote_mtime, verify_checksum)
+
+        if action == SKIP:
+            logger.info(f"Skipping already downloaded file: {file_name}")
+        elif action == ADOPT:
+            logger.info(f"Recording existing local copy in manifest: {file_name}")
+            manifest.record(file_name, local_file_path, remote_size, remote_mtime)
+        elif action == REPAIR:
+            # A truncated local copy is a valid prefix; resume it from its current size.
+            logger.warning(f"Local copy of {file_name} is incomplete, resuming download.")
+            os.replace(local_file_path, partial_path)
+            pending_files.append(file_name)
+        elif action == REFETCH:
+            logger.warning(f"Remote file changed or local copy is corrupt, downloading again: {file_name}")
+            for path in (local_file_path, partial_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            pending_files.append(file_name)
+        else:
+            pending_files.append(file_name)
+
+    # Each worker holds its own FTP session, so the pool size bounds the
+    # number of concurrent connections to the server.
+    try:
+        with ThreadPoolExecutor(max_workers=max_connections) as executor:
+            futures = {executor.submit(download_file, ftp_config, file_name, logger): file_name for file_name in pending_files}
+            for future in as_completed(futures):
+                file_name = futures[future]
+                download_seconds = future.result()
+                if download_seconds is not None:
+                    remote_size, remote_mtime = remote_metadata[file_name]
+                    manifest.record(
+                        file_name,
+                        os.path.join(local_directory, file_name),
+                        remote_size,
+                        remote_mtime,
+                        download_seconds,
+                    )
+    finally:
+        manifest.close()
+
+    logger.info("FTP downloads finished.")
+    local_files = [os.path.join(local_directory, file_name) for file_name in sorted(remote_metadata)]
+    return [path for path in local_files if os.path.exists(path)]
+
+
+def crop_downloaded_files(config, local_files, logger):
+    """Write the basin-cropped cache copy of each downloaded file.
+
+    A file that cannot be cropped is only logged: readers fall back to the
+    raw file.
+    """
+    for local_file in local_files:
+        try:
+            update_cache(local_file, config, logger)
+        except Exception as e:
+            logger.error(f"Failed to crop {local_file}: {e}")
+
+
 def main():
     config = load_config()
     ftp_config = config["ftp"]
 
     logger = setup_logger()
 
-    download_ftp_files(ftp_config, logger)
+    local_files = download_ftp_files(ftp_config, logger)
+    crop_downloaded_files(config, local_files, logger)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import math
+import uuid
+import hashlib
+from array import array
+
+import jarray
+from java.nio.file import Paths
+from mil.army.usace.hec.vortex import VortexGrid
+from mil.army.usace.hec.vortex.geo import VectorUtils
+from org.gdal.osr import CoordinateTransformation, SpatialReference, osrConstants
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from shapefiles import shapefile_digest
+
+
+def grid_signature(grid):
+    """Describe the geometry of a source grid."""
+    return "{},{},{!r},{!r},{!r},{!r},{}".format(
+        grid.nx(), grid.ny(), grid.originX(), grid.originY(), grid.dx(), grid.dy(), grid.wkt()
+    )
+
+
+def weights_key(grid, geo_options):
+    """Cache key for the weights mapping a source grid onto a model's target grid."""
+    parts = [
+        grid_signature(grid),
+        shapefile_digest(geo_options["pathToShp"]),
+        str(geo_options["targetWkt"]),
+        str(geo_options["targetCellSize"]),
+        geo_options["resamplingMethod"],
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _transformation(source_wkt, target_wkt):
+    source = SpatialReference(source_wkt)
+    target = SpatialReference(target_wkt)
+    source.SetAxisMappingStrategy(osrConstants.OAMS_TRADITIONAL_GIS_ORDER)
+    target.SetAxisMappingStrategy(osrConstants.OAMS_TRADITIONAL_GIS_ORDER)
+    return CoordinateTransformation(source, target)
+
+
+def target_grid(geo_options):
+    """Compute the target grid: the clip shapefile envelope in the target CRS, snapped to the cell size."""
+    clip_path = Paths.get(geo_options["pathToShp"])
+    envelope = VectorUtils.getEnvelope(clip_path)
+    transform = _transformation(VectorUtils.getWkt(clip_path), geo_options["targetWkt"])
+    cell_size = float(geo_options["targetCellSize"])
+
+    # Densify the envelope edges so curved projected edges are fully covered.
+    xs = []
+    ys = []
+    steps = 20
+    for i in range(steps + 1):
+        fraction = float(i) / steps
+        x = envelope.getMinX() + fraction * envelope.getWidth()
+        y = envelope.getMinY() + fraction * envelope.getHeight()
+        for px, py in [(x, envelope.getMinY()), (x, envelope.getMaxY()), (envelope.getMinX(), y), (envelope.getMaxX(), y)]:
+            point = transform.TransformPoint(px, py)
+            xs.append(point[0])
+            ys.append(point[1])
+
+    min_x = math.floor(min(xs) / cell_size) * cell_size
+    max_x = math.ceil(max(xs) / cell_size) * cell_size
+    min_y = math.floor(min(ys) / cell_size) * cell_size
+    max_y = math.ceil(max(ys) / cell_size) * cell_size
+
+    return {
+        "nx": int(round((max_x - min_x) / cell_size)),
+        "ny": int(round((max_y - min_y) / cell_size)),
+        "originX": min_x,
+        "originY": max_y,
+        "dx": cell_size,
+        "dy": -cell_size,
+        "wkt": geo_options["targetWkt"],
+    }
+
+
+def build_weights(grid, geo_options):
+    """Build bilinear weights from a source grid to a model's target grid.
+
+    The weights are stored row by row (CSR): the source cells and weights for
+    target cell ``t`` are ``indices[row_ptr[t]:row_ptr[t + 1]]`` and the
+    matching slice of ``weights``.
+    """
+    target = target_grid(geo_options)
+    transform = _transformation(target["wkt"], grid.wkt())
+
+    src_nx, src_ny = grid.nx(), grid.ny()
+    src_x0, src_y0 = grid.originX(), grid.originY()
+    src_dx, src_dy = grid.dx(), grid.dy()
+
+    row_ptr = array("i", [0])
+    indices = array("i")
+    weights = array("f")
+
+    for row in range(target["ny"]):
+        y = target["originY"] + (row + 0.5) * target["dy"]
+        for col in range(target["nx"]):
+            x = target["originX"] + (col + 0.5) * target["dx"]
+            point = transform.TransformPoint(x, y)
+
+            # Fractional index relative to source cell centres
+            fi = (point[0] - src_x0) / src_dx - 0.5
+            fj = (point[1] - src_y0) / src_dy - 0.5
+            i0 = int(math.floor(fi))
+            j0 = int(math.floor(fj))
+            wx = fi - i0
+            wy = fj - j0
+
+            for i, j, w in [
+                (i0, j0, (1 - wx) * (1 - wy)),
+                (i0 + 1, j0, wx * (1 - wy)),
+                (i0, j0 + 1, (1 - wx) * wy),
+                (i0 + 1, j0 + 1, wx * wy),
+            ]:
+                if 0 <= i < src_nx and 0 <= j < src_ny and w > 0:
+                    indices.append(j * src_nx + i)
+                    weights.append(w)
+            row_ptr.append(len(indices))
+
+    return {"grid": target, "row_ptr": row_ptr, "indices": indices, "weights": weights}
+
+
+def save_weights(path, regrid):
+    """Write weights to disk, renaming into place so readers never see a partial file.
+
+    Returns False when another worker put the same weights in place first.
+    """
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    header = dict(regrid["grid"])
+    header["nnz"] = len(regrid["indices"])
+    with open(tmp_path, "wb") as f:
+        f.write((json.dumps(header) + "\n").encode("utf-8"))
+        regrid["row_ptr"].tofile(f)
+        regrid["indices"].tofile(f)
+        regrid["weights"].tofile(f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another worker renamed the same weights into place first
+        os.remove(tmp_path)
+        if not os.path.exists(path):
+            raise
+        return False
+    return True
+
+
+def load_weights(path):
+    """Read weights written by save_weights."""
+    with open(path, "rb") as f:
+        grid = json.loads(f.readline().decode("utf-8"))
+        nnz = grid.pop("nnz")
+        row_ptr = array("i")
+        row_ptr.fromfile(f, grid["nx"] * grid["ny"] + 1)
+        indices = array("i")
+        indices.fromfile(f, nnz)
+        weights = array("f")
+        weights.fromfile(f, nnz)
+    return {"grid": grid, "row_ptr": row_ptr, "indices": indices, "weights": weights}
+
+
+def load_or_build_weights(grid, geo_options, cache_folder, logger):
+    """Return regrid weights for a model, building and caching them on first use.
+
+    The cache file name is derived from the source grid geometry, the clip
+    shapefile contents and the target WKT, cell size and method, so editing
+    the shapefile or the model config automatically selects a new entry.
+    """
+    weights_dir = os.path.join(cache_folder, "regrid")
+    if not os.path.exists(weights_dir):
+        os.makedirs(weights_dir)
+
+    path = os.path.join(weights_dir, weights_key(grid, geo_options) + ".bin")
+    if os.path.exists(path):
+        logger.info("Using cached regrid weights: {}".format(path))
+        return load_weights(path)
+
+    logger.info("Building regrid weights: {}".format(path))
+    regrid = build_weights(grid, geo_options)
+    if not save_weights(path, regrid):
+        logger.info("Regrid weights were cached by another worker, using them: {}".format(path))
+        return load_weights(path)
+    return regrid
+
+
+def apply_weights(regrid, grid):
+    """Regrid one time step with a sparse matrix-vector product and return the new VortexGrid."""
+    target = regrid["grid"]
+    row_ptr = regrid["row_ptr"]
+    indices = regrid["indices"]
+    weights = regrid["weights"]
+    no_data = grid.noDataValue()
+    source = grid.data()
+
+    n_cells = target["nx"] * target["ny"]
+    data = jarray.zeros(n_cells, "f")
+    for t in range(n_cells):
+        total = 0.0
+        weight_sum = 0.0
+        for k in range(row_ptr[t], row_ptr[t + 1]):
+            value = source[indices[k]]
+            if value != no_data and value == value:
+                total += weights[k] * value
+                weight_sum += weights[k]
+        data[t] = total / weight_sum if weight_sum > 0 else no_data
+
+    return build_grid(grid, target, data)
+
+
+def regrid_mismatches(expected, actual, tolerance):
+    """Differences between two regridded VortexGrids of the same time step.
+
+    The origins must agree to a thousandth of a cell, the dimensions exactly
+    and every value within ``tolerance``; a cell with data in one grid and
+    no data in the other is a mismatch. Returns descriptions of what differs.
+    """
+    mismatches = []
+    if (expected.nx(), expected.ny()) != (actual.nx(), actual.ny()):
+        mismatches.append("dimensions {}x{} != {}x{}".format(expected.nx(), expected.ny(), actual.nx(), actual.ny()))
+        return mismatches
+    if (abs(expected.originX() - actual.originX()) > abs(expected.dx()) * 1e-3
+            or abs(expected.originY() - actual.originY()) > abs(expected.dy()) * 1e-3):
+        mismatches.append("origin ({}, {}) != ({}, {})".format(
+            expected.originX(), expected.originY(), actual.originX(), actual.originY()))
+
+    expected_data, expected_no_data = expected.data(), expected.noDataValue()
+    actual_data, actual_no_data = actual.data(), actual.noDataValue()
+    coverage = 0
+    worst = 0.0
+    for t in range(len(expected_data)):
+        a, b = expected_data[t], actual_data[t]
+        a_missing = a == expected_no_data or a != a
+        b_missing = b == actual_no_data or b != b
+        if a_missing or b_missing:
+            coverage += a_missing != b_missing
+        else:
+            worst = max(worst, abs(a - b))
+    if coverage:
+        mismatches.append("{} cells with data in only one grid".format(coverage))
+    if worst > tolerance:
+        mismatches.append("max difference {:.4f} > {}".format(worst, tolerance))
+    return mismatches
+
+
+def grid_geometry(grid):
+    """Return the geometry of a VortexGrid in the form used for target grids."""
+    return {
+        "nx": grid.nx(),
+        "ny": grid.ny(),
+        "originX": grid.originX(),
+        "originY": grid.originY(),
+        "dx": grid.dx(),
+        "dy": grid.dy(),
+        "wkt": grid.wkt(),
+    }
+
+
+def build_grid(template, geometry, data, shift_hours=0):
+    """Build a VortexGrid with new geometry and data, copying metadata from ``template``.
+
+    ``shift_hours`` moves the grid's start and end times.
+    """
+    return VortexGrid.builder() \
+        .dx(geometry["dx"]).dy(geometry["dy"]) \
+        .nx(geometry["nx"]).ny(geometry["ny"]) \
+        .originX(geometry["originX"]).originY(geometry["originY"]) \
+        .wkt(geometry["wkt"]) \
+        .data(data) \
+        .noDataValue(template.noDataValue()) \
+        .units(template.units()) \
+        .fileName(template.fileName()) \
+        .shortName(template.shortName()) \
+        .fullName(template.fullName()) \
+        .description(template.description()) \
+        .startTime(template.startTime().plusHours(shift_hours)) \
+        .endTime(template.endTime().plusHours(shift_hours)) \
+        .interval(template.interval()) \
+        .dataType(template.dataType()) \
+        .build()
@@ -0,0 +1,30 @@
+import jarray
+
+from regrid_weights import build_grid, grid_geometry
+
+
+def scenario_part_f(scenario, base_part_f="ECMWF"):
+    """DSS part F used for a precipitation scenario, e.g. ``ECMWF-HIGH``."""
+    return "{}-{}".format(base_part_f, scenario["name"].upper())
+
+
+def apply_scenario(grids, scenario):
+    """Return a perturbed copy of a model's regridded precipitation grids.
+
+    Supported scenario keys are ``scale`` (multiplies every valid cell, used
+    for scaled rain and upper/lower bounds) and ``shift_hours`` (moves the
+    storm in time by relabelling each grid's start and end times).
+    """
+    scale = float(scenario.get("scale", 1.0))
+    shift_hours = int(scenario.get("shift_hours", 0))
+
+    variant = []
+    for grid in grids:
+        no_data = grid.noDataValue()
+        source = grid.data()
+        data = jarray.zeros(len(source), "f")
+        for i in range(len(source)):
+            value = source[i]
+            data[i] = value * scale if value != no_data and value == value else value
+        variant.append(build_grid(grid, grid_geometry(grid), data, shift_hours))
+    return variant
@@ -0,0 +1,84 @@
+import os
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import yaml
+
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def load_config(config_path="shared/config.yaml"):
+    """Load configuration from a YAML file."""
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)
+
+
+def setup_logger(log_file):
+    """Set up a logger."""
+    log_dir = os.path.dirname(log_file)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    return logging.getLogger()
+
+
+def scenario_forecast_names(model_config):
+    """Forecast alternative names of a model's scenarios, as created by forecast_hec_hms.py."""
+    template_name = model_config["scenario_template"][1]
+    return [f"{template_name}_{scenario['name'].upper()}" for scenario in model_config["scenarios"]]
+
+
+def load_scenario_hydrographs(forecast_dir, forecast_names):
+    """Stack the exported scenario hydrographs into a (scenario, time, element) cube."""
+    frames = []
+    for forecast_name in forecast_names:
+        csv_path = os.path.join(forecast_dir, f"{forecast_name}.csv")
+        if os.path.exists(csv_path):
+            frames.append(pd.read_csv(csv_path, parse_dates=["time"]).assign(scenario=forecast_name))
+    if not frames:
+        return None, None, None
+
+    df = pd.concat(frames, ignore_index=True)
+    df["element"] = df["element"] + " " + df["parameter"]
+    cube = df.set_index(["scenario", "time", "element"])["value"].to_xarray()
+    return cube.values, cube["time"].values, cube["element"].values
+
+
+def summarize_ensemble(flows, times, elements, percentiles=PERCENTILES):
+    """Compute flow percentiles across scenarios for every outlet and time step at once."""
+    values = np.nanpercentile(flows, percentiles, axis=0)  # (percentile, time, element)
+    index = pd.MultiIndex.from_product([elements, times], names=["element", "time"])
+    columns = {f"p{p:02d}": values[i].T.ravel() for i, p in enumerate(percentiles)}
+    columns["max"] = np.nanmax(flows, axis=0).T.ravel()
+    return pd.DataFrame(columns, index=index).reset_index()
+
+
+def main():
+    config = load_config()
+    date_str = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
+
+    for model_name, model_config in config["models"].items():
+        if not model_config.get("scenarios"):
+            continue
+
+        logger = setup_logger(f"logs/{model_name}_forecast.log")
+        forecast_dir = os.path.join("data", "output", model_name, "forecast", date_str)
+        flows, times, elements = load_scenario_hydrographs(forecast_dir, scenario_forecast_names(model_config))
+        if flows is None:
+            logger.warning(f"No scenario hydrographs found in {forecast_dir}. Skipping ensemble summary.")
+            continue
+
+        summary = summarize_ensemble(flows, times, elements)
+        output_path = os.path.join(forecast_dir, "ensemble_summary.csv")
+        summary.to_csv(output_path, index=False)
+        logger.info(f"Ensemble summary of {flows.shape[0]} scenarios saved to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
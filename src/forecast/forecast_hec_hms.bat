@@ -7,7 +7,7 @@ set "GDAL_DATA=%HMS%\bin\gdal\gdal-data"
 set "PROJ_LIB=%HMS%\bin\gdal\projlib"
 
 REM Add HEC-HMS libraries to classpath
-set "CLASSPATH=%HMS%\hms.jar;%HMS%\lib\*"
+set "CLASSPATH=%HMS%\hms.jar;%HMS%\lib\*;lib\sqlite-jdbc.jar"
 
 REM Run Jython script
-C:\jython2.7.4\bin\jython.exe -Djava.library.path="%HMS%\bin;%HMS%\bin\gdal;%HMS%\bin\hdf" src\forecast\forecast_hec_hms.py
+C:\jython2.7.4\bin\jython.exe -Djava.library.path="%HMS%\bin;%HMS%\bin\gdal;%HMS%\bin\hdf" src\forecast\forecast_hec_hms.py %*
@@ -1,9 +1,31 @@
 import os
+import sys
+import time
 import logging
+import argparse
+import threading
+import subprocess
 from datetime import datetime, timedelta
+from Queue import Queue, Empty
+from java.lang import System
+from java.nio.file import FileSystems, Paths, StandardWatchEventKinds
+from java.util.concurrent import TimeUnit
 from hms.model import Project
 from hms import Hms
 import yaml
+from hms_files import create_hms_file, load_hms_file, replace_values
+from hms_results import export_hydrographs
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from state_store import open_state_store
+
+
+SCENARIO_BASE_PART_F = "ECMWF"
+
+IMPORT_STAGE = "import"
+SCENARIO_IMPORT_STAGE = "scenario_import"
+FORECAST_STAGE = "forecast"
+
 
 def load_config(config_path):
     """Load configuration from a YAML file."""
@@ -25,35 +47,55 @@ def setup_logger(log_file):
     return logging.getLogger()
 
 
-def update_forecast_parameters(file_path, start_date, start_time, forecast_date, forecast_time, end_date, end_time, logger):
-    """Update forecast parameters in the HEC-HMS forecast file."""
+def forecast_parameters(model_config, start_date, forecast_date, end_date):
+    """Time window values written to a model's forecast alternatives."""
+    return [
+        ("Start Date", start_date),
+        ("Start Time", model_config["start_time"]),
+        ("Forecast Date", forecast_date),
+        ("Forecast Time", model_config["forecast_time"]),
+        ("End Date", end_date),
+        ("End Time", model_config["end_time"]),
+    ]
+
+
+def update_forecast_parameters(file_path, forecast_names, parameters, logger):
+    """Update the named forecast alternatives of a HEC-HMS forecast file.
+
+    All alternatives are set in one pass over the parsed file, and the file is
+    only rewritten when a value actually changed, so HMS does not see a new
+    modification time on days when nothing moved. A name missing from the
+    file raises ValueError and nothing is written.
+    """
     try:
-        with open(file_path, "r") as file:
-            content = file.readlines()
-
-        for i in range(len(content)):
-            if "Start Date" in content[i]:
-                content[i] = "     Start Date: {}\n".format(start_date)
-            elif "Start Time" in content[i]:
-                content[i] = "     Start Time: {}\n".format(start_time)
-            elif "Forecast Date" in content[i]:
-                content[i] = "     Forecast Date: {}\n".format(forecast_date)
-            elif "Forecast Time" in content[i]:
-                content[i] = "     Forecast Time: {}\n".format(forecast_time)
-            elif "End Date" in content[i]:
-                content[i] = "     End Date: {}\n".format(end_date)
-            elif "End Time" in content[i]:
-                content[i] = "     End Time: {}\n".format(end_time)
-
-        with open(file_path, "w") as file:
-            file.writelines(content)
-
-        logger.info("Forecast parameters updated successfully for file: {}".format(file_path))
+        hms_file = load_hms_file(file_path)
+        blocks = [hms_file.block("Forecast", name) for name in forecast_names]
+        if None in blocks:
+            missing = [name for name, block in zip(forecast_names, blocks) if block is None]
+            raise ValueError("Forecast alternatives {} not found in {}.".format(", ".join(missing), file_path))
+
+        for block in blocks:
+            for key, value in parameters:
+                block.set(key, value)
+
+        if hms_file.save():
+            logger.info("Forecast parameters updated successfully for file: {}".format(file_path))
+        else:
+            logger.info("Forecast parameters already up to date for file: {}".format(file_path))
     except Exception as e:
         logger.error("Error updating forecast parameters for file {}: {}".format(file_path, e))
         raise
 
 
+def update_forecast_files(forecast_paths, parameters, logger):
+    """Update ``[file, forecast name]`` pairs with one read and at most one write per file."""
+    names_by_file = {}
+    for forecast_file_path, forecast_name in forecast_paths:
+        names_by_file.setdefault(forecast_file_path, []).append(forecast_name)
+    for forecast_file_path, forecast_names in names_by_file.items():
+        update_forecast_parameters(forecast_file_path, forecast_names, parameters, logger)
+
+
 def get_dynamic_dates():
     """Calculate dynamic dates for forecast parameters."""
     today = datetime.now()
@@ -69,58 +111,304 @@ def get_dynamic_dates():
     return start_date, forecast_date, end_date, start_date_str
 
 
-def check_date_in_file(date_str, file_path):
-    """Check if a date exists in a file."""
-    if not os.path.exists(file_path):
-        open(file_path, "a").close()
+def run_project_forecasts(project_path, forecast_names, logger):
+    """Open a HEC-HMS project once and compute all of its forecast alternatives."""
+    project = Project.open(project_path)
+    try:
+        for forecast_name in forecast_names:
+            try:
+                project.computeForecast(forecast_name)
+                logger.info("HEC-HMS model run successfully for forecast: {}".format(forecast_name))
+            except Exception as e:
+                logger.error("Error running HEC-HMS model for forecast {}: {}".format(forecast_name, e))
+                raise
+    finally:
+        project.close()
 
-    with open(file_path, "r") as file:
-        dates = [line.strip() for line in file.readlines()]
 
-    return date_str in dates
+def group_models_by_project(model_names, models):
+    """Group models sharing a project file so each project is opened by one worker."""
+    groups = {}
+    for model_name in model_names:
+        project_key = os.path.normcase(os.path.abspath(models[model_name]["project_path"]))
+        groups.setdefault(project_key, []).append(model_name)
+    return list(groups.values())
+
+
+def run_worker(model_names, forecast_names, date_str, config, shutdown=True):
+    """Compute forecasts of models sharing one project in this process's HMS engine.
+
+    ``forecast_names`` restricts the run to those alternatives of the models,
+    e.g. their scenario forecasts; by default all of the models'
+    ``forecast_paths`` are computed. Result hydrographs are exported once
+    the computes succeeded; an export error is logged and does not fail the
+    run. The engine is shut down afterwards unless ``shutdown`` is
+    False, as in a resident process.
+    """
+    models = config["models"]
+    logger = setup_logger("logs/{}_forecast.log".format(model_names[0]))
+    project_path = models[model_names[0]]["project_path"]
+
+    runs = []
+    for model_name in model_names:
+        if forecast_names:
+            runs.extend((model_name, name) for name in scenario_forecast_names(models[model_name]) if name in forecast_names)
+        else:
+            runs.extend((model_name, name) for _, name in models[model_name]["forecast_paths"])
 
+    try:
+        run_project_forecasts(project_path, [name for _, name in runs], logger)
+    except Exception as e:
+        logger.error("Forecast worker failed: {}".format(e))
+        return 1
+    finally:
+        if shutdown:
+            Hms.shutdownEngine()
+
+    # A failed export does not undo a computed forecast
+    for model_name, forecast_name in runs:
+        try:
+            export_hydrographs(model_name, models[model_name], forecast_name, date_str, logger)
+        except Exception as e:
+            logger.error("Exporting hydrographs of forecast {} failed: {}".format(forecast_name, e))
+    return 0
+
+
+def worker_command(model_names, forecast_names, date_str):
+    """Command line that runs this script as a forecast worker."""
+    library_path = System.getProperty("java.library.path")
+    command = [sys.executable, "-Djava.library.path={}".format(library_path), os.path.abspath(__file__),
+               "--date", date_str, "--worker"] + model_names
+    if forecast_names:
+        command += ["--forecasts"] + forecast_names
+    return command
+
+
+def run_workers(jobs, workers, date_str, config, logger):
+    """Run each job in its own worker process, at most ``workers`` at a time.
+
+    A job is ``(model_names, forecast_names)``; ``forecast_names`` may be
+    None to compute every forecast of the models. Every worker starts its own
+    HMS engine, so jobs compute concurrently. With ``workers`` 0 the jobs run
+    one after another in this process, whose engine stays up between runs
+    (``--serve``). Returns the set of model names with at least one failed
+    job.
+    """
+    if not workers:
+        failed = set()
+        for model_names, forecast_names in jobs:
+            logger.info("Computing {} in the resident engine.".format(", ".join(forecast_names or model_names)))
+            if run_worker(model_names, forecast_names, date_str, config, shutdown=False) != 0:
+                failed.update(model_names)
+        return failed
+
+    queue = Queue()
+    for job in jobs:
+        queue.put(job)
+
+    failed = set()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                model_names, forecast_names = queue.get_nowait()
+            except Empty:
+                return
+            description = ", ".join(forecast_names or model_names)
+            logger.info("Starting forecast worker for {}.".format(description))
+            return_code = subprocess.call(worker_command(model_names, forecast_names, date_str))
+            if return_code != 0:
+                logger.error("Forecast worker for {} exited with code {}.".format(description, return_code))
+                with lock:
+                    failed.update(model_names)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return failed
+
+
+def scenario_forecast_name(template_name, scenario):
+    """Name of the forecast alternative computed for a precipitation scenario."""
+    return "{}_{}".format(template_name, scenario["name"].upper())
+
+
+def scenario_forecast_names(model_config):
+    """Names of a model's scenario forecast alternatives."""
+    template_name = model_config.get("scenario_template", [None, None])[1]
+    return [scenario_forecast_name(template_name, scenario) for scenario in model_config.get("scenarios", [])]
+
+
+def add_scenario_grids(grid_file, scenario, logger):
+    """Clone every grid of a grid file that reads the ``/ECMWF/`` DSS part F for a scenario.
+
+    The copies read the scenario's records (``/ECMWF-<NAME>/``), as written
+    by ``import_automation.py --scenarios``. Returns ``{grid name: scenario
+    grid name}``; raises ValueError when no grid reads ``/ECMWF/``.
+    """
+    base = "/{}/".format(SCENARIO_BASE_PART_F)
+    part_f = "/{}-{}/".format(SCENARIO_BASE_PART_F, scenario["name"].upper())
+    hms_file = load_hms_file(grid_file)
+    sources = [block for block in hms_file.blocks
+               if block.type == "Grid" and any(base in line for line in block.copy_lines())]
+    if not sources:
+        raise ValueError("No grid in {} reads DSS part F {}".format(grid_file, base))
+
+    renamed = {}
+    for block in sources:
+        name = "{}_{}".format(block.name, scenario["name"].upper())
+        renamed[block.name] = name
+        if hms_file.block("Grid", name) is None:
+            hms_file.add_block([line.replace(base, part_f) for line in block.copy_lines()], name)
+            logger.info("Created scenario grid {} in {}".format(name, grid_file))
+    hms_file.save()
+    return renamed
+
+
+def add_scenario_meteorology(project_path, met_file, grids, scenario, logger):
+    """Copy a meteorologic model into its own .met file reading the scenario grids.
+
+    The copy is registered in the project next to the original. Returns the
+    ``{met model name: scenario met model name}`` mapping.
+    """
+    template = load_hms_file(met_file)
+    met_blocks = template.blocks_of_type("Meteorology")
+    if not met_blocks:
+        raise ValueError("No meteorologic model in {}".format(met_file))
+    met_name = met_blocks[0].name
+    scenario_name = "{}_{}".format(met_name, scenario["name"].upper())
+    stem, extension = os.path.splitext(met_file)
+    scenario_file = "{}_{}{}".format(stem, scenario["name"].upper(), extension)
+
+    if not os.path.exists(scenario_file):
+        lines, grid_references = replace_values(template.lines, grids)
+        lines, _ = replace_values(lines, {met_name: scenario_name})
+        if not grid_references:
+            raise ValueError("Meteorologic model {} does not read any of the grids {}".format(
+                met_name, ", ".join(sorted(grids))))
+        create_hms_file(scenario_file, lines).save()
+        logger.info("Created scenario meteorologic model {} in {}".format(scenario_name, scenario_file))
+
+    project = load_hms_file(project_path)
+    if not any(block.name == scenario_name for block in project.blocks):
+        entries = [block for block in project.blocks if block.get("Filename") == os.path.basename(met_file)]
+        if not entries:
+            raise ValueError("Meteorologic model file {} is not listed in {}".format(met_file, project_path))
+        lines, _ = replace_values(entries[0].copy_lines(), {
+            met_name: scenario_name, os.path.basename(met_file): os.path.basename(scenario_file)})
+        project.add_block(lines)
+        project.save()
+    return {met_name: scenario_name}
+
+
+def create_scenario_forecasts(model_config, logger):
+    """Give each scenario its own grids, meteorologic model and forecast alternative.
+
+    Per scenario, the grids of ``scenario_grid_file`` that read ``/ECMWF/``
+    are cloned onto the scenario's DSS records, the template forecast's
+    meteorologic model ``scenario_met`` is copied to read those grids, and
+    the template forecast is copied to use that model. Existing components
+    are kept. The forecast blocks stay in the cached file model until the
+    next save. Returns the scenario forecast names.
+    """
+    forecast_file, template_name = model_config["scenario_template"]
+    hms_file = load_hms_file(forecast_file)
+    template = hms_file.block("Forecast", template_name)
+    if template is None:
+        raise ValueError("Template forecast {} not found in {}".format(template_name, forecast_file))
+
+    names = []
+    for scenario in model_config["scenarios"]:
+        name = scenario_forecast_name(template_name, scenario)
+        names.append(name)
+        if hms_file.block("Forecast", name) is not None:
+            continue
+        grids = add_scenario_grids(model_config["scenario_grid_file"], scenario, logger)
+        met = add_scenario_meteorology(model_config["project_path"], model_config["scenario_met"], grids, scenario, logger)
+        lines, count = replace_values(hms_file.block("Forecast", template_name).copy_lines(), met)
+        if not count:
+            raise ValueError("Template forecast {} does not use meteorologic model {}".format(
+                template_name, ", ".join(met)))
+        hms_file.add_block(lines, name)
+        logger.info("Created scenario forecast {} in {}".format(name, forecast_file))
+    return names
+
+
+def run_scenarios(config, state, workers):
+    """Compute the precipitation scenario forecasts of every model with ``scenarios`` configured.
+
+    Only models whose scenario DSS records have been imported for the start
+    date run. The scenario alternatives of one project are computed by one
+    worker, so no project is opened by two processes; each worker exports
+    its hydrographs, which ``ensemble_summary.py`` then reduces to
+    percentiles per outlet.
+    """
+    start_date, forecast_date, end_date, start_date_str = get_dynamic_dates()
+
+    ready_models = []
+    forecast_names = []
+    for model_name, model_config in config["models"].items():
+        if not model_config.get("scenarios"):
+            continue
+        logger = setup_logger("logs/{}_forecast.log".format(model_name))
 
-def append_date_to_file(date_str, file_path):
-    """Append a date to a file."""
-    with open(file_path, "a") as file:
-        file.write("{}\n".format(date_str))
+        if not state.is_done(IMPORT_STAGE, model_name, start_date_str):
+            logger.info("Data for start date {} has not been imported yet. Skipping scenarios.".format(start_date_str))
+            continue
+        if not state.is_done(SCENARIO_IMPORT_STAGE, model_name, start_date_str):
+            logger.info("Scenarios for start date {} have not been imported yet. Skipping scenarios.".format(start_date_str))
+            continue
 
+        forecast_file_path, template_name = model_config["scenario_template"]
+        names = create_scenario_forecasts(model_config, logger)
+        parameters = forecast_parameters(model_config, start_date, forecast_date, end_date)
+        update_forecast_parameters(forecast_file_path, [template_name] + names, parameters, logger)
 
-def running_hms(project_path, forecast_name, logger):
-    """Run HEC-HMS model for a forecast."""
-    try:
-        project = Project.open(project_path)
-        project.computeForecast(forecast_name)
-        project.close()
+        ready_models.append(model_name)
+        forecast_names.extend(names)
 
-        logger.info("HEC-HMS model run successfully for forecast: {}".format(forecast_name))
-    except Exception as e:
-        logger.error("Error running HEC-HMS model for forecast {}: {}".format(forecast_name, e))
-        raise
+    if not ready_models:
+        return
 
+    jobs = [(model_names, forecast_names) for model_names in group_models_by_project(ready_models, config["models"])]
+    failed = run_workers(jobs, workers, start_date_str, config, logging.getLogger())
+    if failed:
+        sys.exit(1)
 
-def main():
-    config_path = "shared/config.yaml"
-    config = load_config(config_path)
 
+def run_daily_forecasts(config, state, workers, model_names=None):
+    """Run today's forecast of every model (or of ``model_names``) whose data has been imported.
+
+    A model's forecast is claimed in the ``state`` store before it runs, so
+    two processes never compute the same forecast. Returns the set of models
+    whose forecast failed.
+    """
     cutoff_hour = 12
     cutoff_minute = 35
 
+    # Dynamic date calculations
+    start_date, forecast_date, end_date, start_date_str = get_dynamic_dates()
+
+    ready_models = []
+    loggers = {}
+    failed = set()
+
     # Process each model
     for model_name, model_config in config["models"].items():
+        if model_names is not None and model_name not in model_names:
+            continue
+
         # Set up logger for each model
         log_file = "logs/{}_forecast.log".format(model_name)
         logger = setup_logger(log_file)
-
-        # Dynamic date calculations
-        start_date, forecast_date, end_date, start_date_str = get_dynamic_dates()
-
-        # Paths
-        processed_dates_log = model_config["processed_dates_log"]
-        forecast_dates_file = "logs/{}_forecast_dates.txt".format(model_name)
+        loggers[model_name] = logger
 
         # Check if data has been imported
-        if not check_date_in_file(start_date_str, processed_dates_log):
+        if not state.is_done(IMPORT_STAGE, model_name, start_date_str):
             now = datetime.now()
             cutoff = now.replace(hour=cutoff_hour, minute=cutoff_minute, second=0, microsecond=0)
             if now >= cutoff:
@@ -131,37 +419,163 @@ def main():
         else:
             logger.info("Data for start date {} has been imported.".format(start_date_str))
 
-        # Check if forecast has already been run
-        if check_date_in_file(start_date_str, forecast_dates_file):
-            logger.info("Forecast has already been run for start date {}. Skipping HEC-HMS run.".format(start_date_str))
+        # Check if forecast has already been run, or is being run elsewhere
+        if not state.claim(FORECAST_STAGE, model_name, start_date_str):
+            logger.info("Forecast is done or running for start date {}. Skipping HEC-HMS run.".format(start_date_str))
             continue
         else:
             logger.info("Forecast has not been run for start date {}. Proceeding to run HEC-HMS.".format(start_date_str))
 
-        # Update forecast parameters and run HEC-HMS model for each forecast
-        project_path = model_config["project_path"]
-        for forecast_file_path, forecast_name in model_config["forecast_paths"]:
-            # Update forecast parameters
-            update_forecast_parameters(
-                file_path=forecast_file_path,
-                start_date=start_date,
-                start_time=model_config["start_time"],
-                forecast_date=forecast_date,
-                forecast_time=model_config["forecast_time"],
-                end_date=end_date,
-                end_time=model_config["end_time"],
-                logger=logger,
-            )
-
-            # Run HEC-HMS model
-            running_hms(project_path, forecast_name, logger)
-
-        # Append start_date_str to forecast_dates.txt
-        append_date_to_file(start_date_str, forecast_dates_file)
-        logger.info("Start date {} appended to forecast dates.".format(start_date_str))
-
-    # Shutdown HEC-HMS engine
-    Hms.shutdownEngine()
+        # Update forecast parameters, one read/write per forecast file
+        parameters = forecast_parameters(model_config, start_date, forecast_date, end_date)
+        try:
+            update_forecast_files(model_config["forecast_paths"], parameters, logger)
+        except Exception as e:
+            state.fail(FORECAST_STAGE, model_name, start_date_str, e)
+            failed.add(model_name)
+            continue
+
+        ready_models.append(model_name)
+
+    if not ready_models:
+        return failed
+
+    # Run HEC-HMS: one worker process per project, each opening its project once
+    jobs = [(model_names, None) for model_names in group_models_by_project(ready_models, config["models"])]
+    run_failed = run_workers(jobs, workers, start_date_str, config, logging.getLogger())
+    failed.update(run_failed)
+
+    # Record each model's outcome
+    for model_name in ready_models:
+        if model_name in run_failed:
+            state.fail(FORECAST_STAGE, model_name, start_date_str)
+        else:
+            state.complete(FORECAST_STAGE, model_name, start_date_str)
+            loggers[model_name].info("Forecast for start date {} recorded as done.".format(start_date_str))
+
+    return failed
+
+
+def retry_due(failures, key, base_seconds, max_seconds):
+    """True unless ``key`` failed and its backoff has not passed.
+
+    ``failures`` maps a key to (failure count, time of the last failure);
+    the delay doubles with each failure up to ``max_seconds``.
+    """
+    if key not in failures:
+        return True
+    count, failed_at = failures[key]
+    return time.time() >= failed_at + min(base_seconds * 2 ** (count - 1), max_seconds)
+
+
+def watch_state_store(config, state, workers, poll_seconds):
+    """Run each model's forecast as soon as the state store records its import.
+
+    The state store's directory is watched; a write to the database or its
+    WAL checks every model, which is a few indexed lookups. When no event
+    arrives for ``poll_seconds`` (or events were dropped), the same check
+    runs as a fallback. A model whose forecast failed is left out of the
+    checks until its backoff (``watch_retry_seconds``, doubled per failure
+    up to ``watch_retry_max_seconds``) has passed, so the writes recording
+    the failure do not rerun it straight away.
+    """
+    logger = logging.getLogger()
+    retry_seconds = config["shared"].get("watch_retry_seconds", 300)
+    retry_max_seconds = config["shared"].get("watch_retry_max_seconds", 3600)
+    failures = {}
+    db_path = os.path.abspath(config["shared"].get("state_store", "logs/pipeline_state.sqlite"))
+    db_files = set([os.path.basename(db_path), os.path.basename(db_path) + "-wal"])
+
+    watcher = FileSystems.getDefault().newWatchService()
+    Paths.get(os.path.dirname(db_path)).register(watcher, StandardWatchEventKinds.ENTRY_CREATE, StandardWatchEventKinds.ENTRY_MODIFY)
+    logger.info("Watching the state store {}.".format(db_path))
+
+    try:
+        while True:
+            key = watcher.poll(poll_seconds, TimeUnit.SECONDS)
+            events = [] if key is None else list(key.pollEvents())
+            if key is not None:
+                key.reset()
+                if not any(event.kind() == StandardWatchEventKinds.OVERFLOW or str(event.context()) in db_files
+                           for event in events):
+                    continue
+
+            start_date_str = get_dynamic_dates()[3]
+            due = [name for name in config["models"]
+                   if retry_due(failures, (name, start_date_str), retry_seconds, retry_max_seconds)]
+            if not due:
+                continue
+            try:
+                failed = run_daily_forecasts(config, state, workers, due)
+            except Exception as e:
+                logger.error("Forecast check failed: {}".format(e))
+                continue
+            for name in due:
+                if name in failed:
+                    count = failures.get((name, start_date_str), (0, None))[0] + 1
+                    failures[(name, start_date_str)] = (count, time.time())
+                else:
+                    failures.pop((name, start_date_str), None)
+            if failed:
+                logger.error("Forecast failed for models: {}, retrying after backoff".format(", ".join(sorted(failed))))
+    finally:
+        watcher.close()
+
+
+def serve(description):
+    """Keep the JVM and the HEC-HMS classes loaded and run once per line read from stdin.
+
+    Each line holds the command-line arguments of one run (empty for the
+    daily run). Forecasts are computed in this process rather than in worker
+    processes, so the engine started by the first run is reused. After each
+    run ``DONE <exit code>`` is written to stdout, so the pipeline daemon
+    can reuse this process for every cycle.
+    """
+    for line in iter(sys.stdin.readline, ""):
+        code = 0
+        try:
+            main(line.split(), resident=True)
+        except SystemExit as e:
+            code = e.code or 0
+        except Exception:
+            logging.getLogger().exception("{} run failed: {}".format(description, line.strip()))
+            code = 1
+        sys.stdout.write("DONE {}\n".format(code))
+        sys.stdout.flush()
+
+
+def main(argv=None, resident=False):
+    parser = argparse.ArgumentParser(description="Run HEC-HMS forecasts for all configured models.")
+    parser.add_argument("--models", nargs="+", help="only run these models")
+    parser.add_argument("--scenarios", action="store_true", help="compute the configured precipitation scenarios")
+    parser.add_argument("--worker", nargs="+", metavar="MODEL", help=argparse.SUPPRESS)
+    parser.add_argument("--forecasts", nargs="+", help=argparse.SUPPRESS)
+    parser.add_argument("--date", help=argparse.SUPPRESS)
+    parser.add_argument("--serve", action="store_true", help="stay resident and run once per line read from stdin")
+    parser.add_argument("--watch", action="store_true", help="run each model's forecast as soon as its data is imported")
+    args = parser.parse_args(argv)
+
+    config_path = "shared/config.yaml"
+    config = load_config(config_path)
+    workers = 0 if resident else config["shared"].get("forecast_workers", 2)
+
+    if args.worker:
+        sys.exit(run_worker(args.worker, args.forecasts, args.date, config))
+
+    if args.serve:
+        serve("Forecast")
+        return
+
+    state = open_state_store(config)
+    try:
+        if args.scenarios:
+            run_scenarios(config, state, workers)
+        elif args.watch:
+            watch_state_store(config, state, workers, config["shared"].get("watch_poll_seconds", 300))
+        elif run_daily_forecasts(config, state, workers, args.models):
+            sys.exit(1)
+    finally:
+        state.close()
 
 
 if __name__ == "__main__":
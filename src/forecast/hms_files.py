@@ -0,0 +1,203 @@
+import io
+import os
+import uuid
+
+
+ENCODING = "latin-1"
+
+# Parsed files keyed by absolute path, reused while the file's mtime and size are unchanged.
+_cache = {}
+
+
+def _replace(src, dst):
+    """Atomically replace ``dst`` with ``src``."""
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        # Jython 2.7 has no os.replace
+        from java.nio.file import Files, Paths, StandardCopyOption
+        Files.move(Paths.get(src), Paths.get(dst), StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE)
+
+
+def _split_line(line):
+    """Split ``"     Key: Value"`` into (indent, key, value); key is None for other lines."""
+    stripped = line.strip()
+    if ":" not in stripped:
+        return None, None, None
+    key, value = stripped.split(":", 1)
+    indent = line[:len(line) - len(line.lstrip())]
+    return indent, key.strip(), value.strip()
+
+
+def _line_ending(line):
+    return line[len(line.rstrip("\r\n")):] or "\n"
+
+
+def replace_values(lines, mapping):
+    """Point every ``Key: Value`` line whose value is a key of ``mapping`` at the mapped value.
+
+    Returns the new lines and the number of lines changed.
+    """
+    result = []
+    count = 0
+    for line in lines:
+        indent, key, value = _split_line(line)
+        if key is not None and value in mapping:
+            line = u"{}{}: {}{}".format(indent, key, mapping[value], _line_ending(line))
+            count += 1
+        result.append(line)
+    return result, count
+
+
+class HmsBlock(object):
+    """One ``Type: Name ... End:`` block of an HMS file, addressed by type and name."""
+
+    def __init__(self, hms_file, block_type, name, start, end):
+        self.hms_file = hms_file
+        self.type = block_type
+        self.name = name
+        self.start = start
+        self.end = end
+
+    def _key_index(self, key):
+        lines = self.hms_file.lines
+        for i in range(self.start + 1, self.end):
+            if _split_line(lines[i])[1] == key:
+                return i
+        return None
+
+    def get(self, key):
+        """Return the value of a key in this block, or None."""
+        index = self._key_index(key)
+        return None if index is None else _split_line(self.hms_file.lines[index])[2]
+
+    def set(self, key, value):
+        """Set an existing key, keeping its indentation. Returns True if the value changed."""
+        index = self._key_index(key)
+        if index is None:
+            return False
+        line = self.hms_file.lines[index]
+        indent, _, current = _split_line(line)
+        value = "{}".format(value)
+        if current == value:
+            return False
+        self.hms_file.lines[index] = u"{}{}: {}{}".format(indent, key, value, _line_ending(line))
+        self.hms_file.dirty = True
+        return True
+
+    def copy_lines(self):
+        """Return the raw lines of this block, header and ``End:`` included."""
+        return list(self.hms_file.lines[self.start:self.end + 1])
+
+
+class HmsFile(object):
+    """In-memory model of an HMS project component file (.forecast, .control, ...).
+
+    The file is kept as its original lines so that untouched content is
+    written back byte for byte; blocks index into those lines.
+    """
+
+    def __init__(self, path, lines, stamp):
+        self.path = path
+        self.lines = lines
+        self.stamp = stamp
+        self.dirty = False
+        self.blocks = []
+        self._parse()
+
+    def _parse(self):
+        self.blocks = []
+        start = None
+        block_type = name = None
+        for i, line in enumerate(self.lines):
+            if line[:1].isspace() or not line.strip():
+                continue
+            _, key, value = _split_line(line)
+            if key is None:
+                continue
+            if key == "End" and start is not None:
+                self.blocks.append(HmsBlock(self, block_type, name, start, i))
+                start = None
+            elif start is None:
+                start, block_type, name = i, key, value
+
+    def block(self, block_type, name):
+        """Return the block with the given type and name, or None."""
+        for block in self.blocks:
+            if block.type == block_type and block.name == name:
+                return block
+        return None
+
+    def blocks_of_type(self, block_type):
+        return [block for block in self.blocks if block.type == block_type]
+
+    def newline(self):
+        """Line ending used by the file (HMS writes CRLF); LF for an empty file."""
+        return _line_ending(self.lines[0]) if self.lines else u"\n"
+
+    def add_block(self, lines, name=None):
+        """Append a copy of a block's lines, optionally renaming it, and return the new block.
+
+        The added lines use the file's own line ending.
+        """
+        newline = self.newline()
+        lines = [line.rstrip("\r\n") + newline for line in lines]
+        if name is not None:
+            _, block_type, _ = _split_line(lines[0])
+            lines[0] = u"{}: {}{}".format(block_type, name, newline)
+        if self.lines and not self.lines[-1].endswith(("\n", "\r")):
+            self.lines[-1] += newline
+        if self.lines and self.lines[-1].strip():
+            self.lines.append(newline)
+        self.lines.extend(lines)
+        self.dirty = True
+        self._parse()
+        return self.blocks[-1]
+
+    def save(self):
+        """Write the file only if something changed, via a temp file renamed into place.
+
+        Returns True if the file was written.
+        """
+        if not self.dirty:
+            return False
+        tmp_path = "{}.{}.tmp".format(self.path, uuid.uuid4().hex)
+        with io.open(tmp_path, "w", encoding=ENCODING, newline="") as f:
+            f.write(u"".join(self.lines))
+        _replace(tmp_path, self.path)
+        self.dirty = False
+        self.stamp = _stamp(self.path)
+        return True
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def create_hms_file(path, lines):
+    """Model of a new HMS file with the given lines, written by its first ``save``."""
+    key = os.path.abspath(path)
+    hms_file = HmsFile(key, list(lines), None)
+    hms_file.dirty = True
+    _cache[key] = hms_file
+    return hms_file
+
+
+def load_hms_file(path):
+    """Parse an HMS file, reusing the cached model while the file is unchanged on disk.
+
+    Unsaved edits on the cached model are kept, so several callers can batch
+    their changes into a single ``save``.
+    """
+    key = os.path.abspath(path)
+    stamp = _stamp(key)
+    cached = _cache.get(key)
+    if cached is not None and cached.stamp == stamp:
+        return cached
+
+    with io.open(key, "r", encoding=ENCODING, newline="") as f:
+        lines = f.readlines()
+    hms_file = HmsFile(key, lines, stamp)
+    _cache[key] = hms_file
+    return hms_file
@@ -0,0 +1,74 @@
+import os
+import csv
+from datetime import datetime, timedelta
+from hec.heclib.dss import HecDss
+
+
+DEFAULT_PATHNAME = "//{element}/{parameter}//1HOUR/FORECAST:{forecast}/"
+DEFAULT_PARAMETER = "FLOW"
+
+# HEC time values are minutes since 31 December 1899 00:00.
+HEC_EPOCH = datetime(1899, 12, 31)
+
+
+def forecast_output_dir(model_name, date_str):
+    """Directory holding the exported hydrographs of a model's forecasts for a date."""
+    return os.path.join("data", "output", model_name, "forecast", date_str)
+
+
+def read_hydrographs(model_config, forecast_name, logger):
+    """Read the configured result hydrographs of a computed forecast from its DSS output.
+
+    Entries of ``results.elements`` are either an element name (its FLOW
+    series is read) or an ``[element, parameter]`` pair such as
+    ``["Reservoir", "FLOW-INFLOW"]``. Returns a list of
+    (time, element, parameter, value) rows. Raises ValueError when the DSS
+    file does not exist, as opening it would create an empty one.
+    """
+    results_config = model_config["results"]
+    dss_file = results_config["dss_file"].format(forecast=forecast_name)
+    if not os.path.exists(dss_file):
+        raise ValueError("Result DSS file {} of forecast {} does not exist, check results.dss_file in the model config.".format(
+            dss_file, forecast_name))
+    pathname_template = results_config.get("pathname", DEFAULT_PATHNAME)
+
+    rows = []
+    dss = HecDss.open(dss_file)
+    try:
+        for entry in results_config.get("elements", []):
+            if isinstance(entry, list):
+                element, parameter = entry
+            else:
+                element, parameter = entry, DEFAULT_PARAMETER
+            pathname = pathname_template.format(
+                element=element.upper(), parameter=parameter.upper(), forecast=forecast_name.upper())
+            try:
+                container = dss.get(pathname, True)
+            except Exception as e:
+                logger.warning("Could not read {} from {}: {}".format(pathname, dss_file, e))
+                continue
+            for minutes, value in zip(container.times, container.values):
+                time = HEC_EPOCH + timedelta(minutes=minutes)
+                rows.append((time.strftime("%Y-%m-%d %H:%M"), element, parameter, value))
+    finally:
+        dss.done()
+    return rows
+
+
+def export_hydrographs(model_name, model_config, forecast_name, date_str, logger):
+    """Export a forecast's result hydrographs to ``<forecast_output_dir>/<forecast>.csv``."""
+    if not model_config.get("results"):
+        return None
+
+    rows = read_hydrographs(model_config, forecast_name, logger)
+    output_dir = forecast_output_dir(model_name, date_str)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    output_path = os.path.join(output_dir, "{}.csv".format(forecast_name))
+    with open(output_path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time", "element", "parameter", "value"])
+        writer.writerows(rows)
+    logger.info("Exported {} result values for forecast {} to {}".format(len(rows), forecast_name, output_path))
+    return output_path
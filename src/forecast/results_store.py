@@ -0,0 +1,147 @@
+import os
+import re
+import glob
+import logging
+import argparse
+from datetime import datetime, timedelta
+import pandas as pd
+import yaml
+
+
+PARTITION_DATE = re.compile(r"^date=(\d{8})$")
+
+
+def load_config(config_path="shared/config.yaml"):
+    """Load configuration from a YAML file."""
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)
+
+
+def setup_logger(log_file):
+    """Set up a logger."""
+    log_dir = os.path.dirname(log_file)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    return logging.getLogger()
+
+
+def partition_dir(store_root, model_name, date_str):
+    """Directory of one model/issue-date partition of the store."""
+    return os.path.join(store_root, f"model={model_name}", f"date={date_str}")
+
+
+def ingest_forecast_exports(store_root, model_name, date_str, forecast_dir, logger):
+    """Copy the hydrographs exported by the forecast workers into the store.
+
+    Each forecast becomes one Parquet file in its model/date partition,
+    sorted by element and time. Older partitions are never touched, and
+    re-ingesting a date only replaces that date's files.
+    """
+    csv_paths = [path for path in glob.glob(os.path.join(forecast_dir, "*.csv"))
+                 if os.path.basename(path) != "ensemble_summary.csv"]
+    if not csv_paths:
+        logger.info(f"No exported hydrographs in {forecast_dir}.")
+        return 0
+
+    output_dir = partition_dir(store_root, model_name, date_str)
+    os.makedirs(output_dir, exist_ok=True)
+
+    for csv_path in csv_paths:
+        forecast_name = os.path.splitext(os.path.basename(csv_path))[0]
+        df = pd.read_csv(csv_path, parse_dates=["time"])
+        df = df.astype({"element": "category", "parameter": "category", "value": "float32"})
+        df.insert(0, "forecast", pd.Categorical([forecast_name] * len(df)))
+        df = df.sort_values(["element", "parameter", "time"], ignore_index=True)
+
+        output_path = os.path.join(output_dir, f"{forecast_name}.parquet")
+        tmp_path = output_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, output_path)
+
+    logger.info(f"Stored {len(csv_paths)} forecasts for {model_name} {date_str} in {output_dir}")
+    return len(csv_paths)
+
+
+def list_issue_dates(store_root, model_name):
+    """Issue dates stored for a model, oldest first."""
+    model_dir = os.path.join(store_root, f"model={model_name}")
+    if not os.path.isdir(model_dir):
+        return []
+    dates = [PARTITION_DATE.match(name) for name in os.listdir(model_dir)]
+    return sorted(match.group(1) for match in dates if match)
+
+
+def load_forecasts(store_root, model_name, element=None, parameter="FLOW", forecast=None, last=None):
+    """Load stored hydrographs for a model, indexed by issue date and time.
+
+    Only the partitions of the ``last`` issue dates are opened, and the
+    element/parameter/forecast filters are pushed down to the Parquet reader.
+    """
+    dates = list_issue_dates(store_root, model_name)
+    if last is not None:
+        dates = dates[-last:]
+
+    filters = []
+    if element is not None:
+        filters.append(("element", "==", element))
+    if parameter is not None:
+        filters.append(("parameter", "==", parameter))
+    if forecast is not None:
+        filters.append(("forecast", "==", forecast))
+
+    frames = []
+    for date_str in dates:
+        for path in sorted(glob.glob(os.path.join(partition_dir(store_root, model_name, date_str), "*.parquet"))):
+            df = pd.read_parquet(path, filters=filters or None)
+            frames.append(df.assign(issue_date=pd.Timestamp(date_str)))
+    if not frames:
+        return pd.DataFrame(columns=["issue_date", "time", "forecast", "element", "parameter", "value"]).set_index(["issue_date", "time"])
+
+    return pd.concat(frames, ignore_index=True).set_index(["issue_date", "time"]).sort_index()
+
+
+def peak_flows(store_root, model_name, element, parameter="FLOW", last=30):
+    """Peak value and its time for each of the last ``last`` forecasts of an element.
+
+    For example ``peak_flows(root, "tilong", "Reservoir", "FLOW-INFLOW")``
+    gives the forecast peak inflow of the reservoir per issue date.
+    """
+    df = load_forecasts(store_root, model_name, element=element, parameter=parameter, last=last).reset_index()
+    if df.empty:
+        return pd.DataFrame(columns=["issue_date", "forecast", "peak_time", "peak_value"])
+
+    peaks = df.loc[df.groupby(["issue_date", "forecast"], observed=True)["value"].idxmax()]
+    return peaks.rename(columns={"time": "peak_time", "value": "peak_value"})[
+        ["issue_date", "forecast", "peak_time", "peak_value"]
+    ].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store HEC-HMS forecast hydrographs and query forecast peaks.")
+    parser.add_argument("--date", help="issue date to ingest (YYYYMMDD), defaults to yesterday")
+    parser.add_argument("--peaks", nargs="+", metavar=("MODEL", "ELEMENT"),
+                        help="print the peaks of the last forecasts: MODEL ELEMENT [PARAMETER]")
+    parser.add_argument("--last", type=int, default=30, help="number of forecasts for --peaks")
+    args = parser.parse_args()
+
+    config = load_config()
+    store_root = config["shared"].get("results_store", "data/output/results")
+
+    if args.peaks:
+        print(peak_flows(store_root, *args.peaks[:3], last=args.last).to_string(index=False))
+        return
+
+    date_str = args.date or (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
+    for model_name in config["models"]:
+        logger = setup_logger(f"logs/{model_name}_forecast.log")
+        forecast_dir = os.path.join("data", "output", model_name, "forecast", date_str)
+        ingest_forecast_exports(store_root, model_name, date_str, forecast_dir, logger)
+
+
+if __name__ == "__main__":
+    main()
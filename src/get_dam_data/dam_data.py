@@ -1,53 +1,152 @@
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import sys
+import argparse
 import yaml
-import os
 import logging
+from dam_store import DamStore, migrate_legacy_csv
+from dam_schema import OUTFLOW_COMPONENTS, parse_records, combine_endpoints, write_rejected_report
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# Authentication endpoint
-AUTH_URL = "https://sinbad.sda.pu.go.id/API/PUB/v1/login/"
-
-# Base URLs for the endpoints
+# Base URL of the API; the login endpoint is BASE_URL + "login/"
 BASE_URL = "https://sinbad.sda.pu.go.id/API/PUB/v1/"
-TMA_URL = BASE_URL + "TMA/"
-INFLOW_URL = BASE_URL + "INFLOW/"
-OUTFLOW_URL = BASE_URL + "OUTFLOW/"
+
+# Endpoints fetched for every dam
+ENDPOINTS = ["TMA", "INFLOW", "OUTFLOW"]
 
 # Path to the configuration YAML file
 CONFIG_PATH = "shared/config.yaml"
 
-# Function to authenticate and retrieve token
-def authenticate(username, password):
-    if not username or not password:
-        raise ValueError("Username or Password is not set. Check your configuration file.")
-
-    auth_payload = {"username": username, "password": password}
-    response = requests.post(AUTH_URL, data=auth_payload)
-    
-    if response.status_code == 200:
-        token = response.json().get("token")
-        if token:
+# CSV report of records rejected by validation
+REJECTED_REPORT = "logs/dam_rejected.csv"
+
+# Seconds to wait for the API before giving up on a request
+REQUEST_TIMEOUT = 60
+
+
+class RateLimiter:
+    """Space calls at least ``1 / rate`` seconds apart across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SdaClient:
+    """SDA API client sharing one keep-alive connection pool and bearer token across threads.
+
+    A 401 response triggers a single re-authentication, after which the
+    request is retried once with the new token.
+    """
+
+    def __init__(self, username, password, max_connections=8, rate_limit=None, base_url=BASE_URL):
+        if not username or not password:
+            raise ValueError("Username or Password is not set. Check your configuration file.")
+        self.username = username
+        self.password = password
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.token_lock = threading.Lock()
+        self.token = None
+
+    def authenticate(self, stale_token=None):
+        """Log in and store the token, unless another thread already replaced ``stale_token``."""
+        with self.token_lock:
+            if self.token is not None and self.token != stale_token:
+                return self.token
+            auth_payload = {"username": self.username, "password": self.password}
+            self.rate_limiter.wait()
+            response = self.session.post(self.base_url + "login/", data=auth_payload, timeout=REQUEST_TIMEOUT)
+
+            if response.status_code != 200:
+                raise ConnectionError(f"Failed to authenticate: {response.status_code} {response.text}")
+            token = response.json().get("token")
+            if not token:
+                raise ValueError("Authentication successful but no token returned.")
+            self.token = token
             return token
+
+    def get_data(self, endpoint, dam_id, start_date, end_date):
+        """Fetch one endpoint (``"TMA"``, ``"INFLOW"`` or ``"OUTFLOW"``) for a dam and date range."""
+        endpoint_url = f"{self.base_url}{endpoint}/"
+        params = {"id": dam_id, "from": start_date, "until": end_date}
+        token = self.token or self.authenticate()
+        for attempt in range(2):
+            self.rate_limiter.wait()
+            response = self.session.get(endpoint_url, headers={"Authorization": f"Bearer {token}"},
+                                        params=params, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 401 and attempt == 0:
+                logging.info(f"Token rejected by {endpoint_url}, re-authenticating.")
+                token = self.authenticate(stale_token=token)
+                continue
+            break
+
+        if response.status_code == 200:
+            return response.json()
         else:
-            raise ValueError("Authentication successful but no token returned.")
-    else:
-        raise ConnectionError(f"Failed to authenticate: {response.status_code} {response.text}")
-
-# Function to fetch data from an endpoint
-def get_data(endpoint_url, token, dam_id, start_date, end_date):
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {"id": dam_id, "from": start_date, "until": end_date}
-    response = requests.get(endpoint_url, headers=headers, params=params)
-
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logging.error(f"Failed to fetch data from {endpoint_url}: {response.status_code} {response.text}")
-        return []
+            raise ConnectionError(f"Failed to fetch data from {endpoint_url}: {response.status_code} {response.text}")
+
+    def close(self):
+        self.session.close()
+
+
+def fetch_windows(client, jobs, workers=8):
+    """Fetch TMA, INFLOW and OUTFLOW for every ``(dam_id, (start, end))`` job concurrently.
+
+    At most ``workers`` requests are in flight. Yields ``(dam_id, window,
+    data, complete)`` as soon as the three endpoints of a dam and window have
+    returned, where ``data`` maps endpoint to records and ``complete`` is
+    False if a request failed; failed requests are logged and yield an
+    empty list.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(client.get_data, endpoint, dam_id, *window): (dam_id, window, endpoint)
+            for dam_id, window in jobs
+            for endpoint in ENDPOINTS
+        }
+        pending = {}
+        for future in as_completed(futures):
+            dam_id, window, endpoint = futures[future]
+            data, failed = pending.setdefault((dam_id, window), ({}, []))
+            try:
+                data[endpoint] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to fetch {endpoint} for dam {dam_id} ({window[0]} - {window[1]}): {e}")
+                data[endpoint] = []
+                failed.append(endpoint)
+            if len(data) == len(ENDPOINTS):
+                del pending[(dam_id, window)]
+                yield dam_id, window, data, not failed
+
+
+def fetch_dams(client, dam_ids, start_date, end_date, workers=8):
+    """Fetch TMA, INFLOW and OUTFLOW for all dams concurrently.
+
+    Returns ``{dam_id: {"TMA": [...], "INFLOW": [...], "OUTFLOW": [...]}}``.
+    """
+    jobs = [(dam_id, (start_date, end_date)) for dam_id in dam_ids]
+    return {dam_id: data for dam_id, _, data, _ in fetch_windows(client, jobs, workers)}
 
 # Function to get today's date range
 def get_today_date_range():
@@ -56,44 +155,115 @@ def get_today_date_range():
     end_date = today.strftime("%Y-%m-%d 23:59:59")
     return start_date, end_date
 
+# Function to split a date range into API-sized windows
+def split_date_range(start_day, end_day, window_days):
+    """Split the days ``start_day`` to ``end_day`` (inclusive) into windows of ``window_days`` days."""
+    windows = []
+    day = start_day
+    while day <= end_day:
+        last = min(day + timedelta(days=window_days - 1), end_day)
+        windows.append((day.strftime("%Y-%m-%d 00:00:00"), last.strftime("%Y-%m-%d 23:59:59")))
+        day = last + timedelta(days=1)
+    return windows
+
 # Function to process and combine the data
-def process_data(tma_data, inflow_data, outflow_data):
-    # Convert to DataFrames
-    tma_df = pd.DataFrame(tma_data)
-    inflow_df = pd.DataFrame(inflow_data)
-    outflow_df = pd.DataFrame(outflow_data)
-
-    # Validate and process data
-    required_columns_tma = ["timestamp", "volume", "tma"]
-    required_columns_inflow = ["timestamp", "inflow"]
-    required_columns_outflow = [
-        "timestamp", "outflow_turbin", "outflow_abaku", 
-        "outflow_aindustri", "outflow_irigasi", 
-        "outflow_limpas", "outflow_pemeliharaan"
-    ]
-
-    # Process outflow data
-    outflow_df["outflow"] = (
-        outflow_df["outflow_turbin"] +
-        outflow_df["outflow_abaku"] +
-        outflow_df["outflow_aindustri"] +
-        outflow_df["outflow_irigasi"] +
-        outflow_df["outflow_limpas"] +
-        outflow_df["outflow_pemeliharaan"]
-    )
-    outflow_df = outflow_df[["timestamp", "outflow"]]
-
-    # Merge the data on the timestamp
-    merged_df = pd.merge(tma_df, inflow_df, on="timestamp", how="outer")
-    merged_df = pd.merge(merged_df, outflow_df, on="timestamp", how="outer")
-
-    # Drop unnecessary columns like id_x and id_y
-    merged_df = merged_df.drop(columns=[col for col in merged_df.columns if col.startswith("id_")], errors="ignore")
-
-    return merged_df
+def process_data(dam_id, tma_data, inflow_data, outflow_data, rejected_report=REJECTED_REPORT):
+    """Parse, validate and align the three endpoints of a dam into one typed frame.
+
+    Rejected records are logged and appended to ``rejected_report``.
+    """
+    parsed = {}
+    rejected = []
+    for endpoint, records in (("TMA", tma_data), ("INFLOW", inflow_data), ("OUTFLOW", outflow_data)):
+        parsed[endpoint], endpoint_rejected = parse_records(endpoint, records, dam_id)
+        if not endpoint_rejected.empty:
+            logging.warning(f"Rejected {len(endpoint_rejected)} of {len(records)} {endpoint} records of dam {dam_id}.")
+            rejected.append(endpoint_rejected)
+
+    if rejected:
+        write_rejected_report(pd.concat(rejected, ignore_index=True), rejected_report)
+
+    partial = int(parsed["OUTFLOW"][OUTFLOW_COMPONENTS].isna().any(axis=1).sum())
+    if partial:
+        logging.warning(f"{partial} OUTFLOW records of dam {dam_id} miss some components; summed the reported ones.")
+
+    return combine_endpoints(dam_id, parsed["TMA"], parsed["INFLOW"], parsed["OUTFLOW"])
+
+
+def dam_ids_by_model(models_config):
+    """Map each model with a ``dam_id`` to it."""
+    dam_models = {}
+    for model_name, model_details in models_config.items():
+        # Extract the dam ID
+        dam_id = model_details.get("dam_id")
+        if not dam_id:
+            logging.warning(f"No dam_id specified for model: {model_name}. Skipping...")
+            continue
+        dam_models[model_name] = dam_id
+    return dam_models
+
+
+def collect_today(client, store, dam_models, workers):
+    """Fetch and store today's records of every model's dam."""
+    start_date, end_date = get_today_date_range()
+
+    # Fetch TMA, Inflow, and Outflow data of all dams at once
+    logging.info(f"Fetching data for Dam IDs: {', '.join(sorted(str(dam_id) for dam_id in set(dam_models.values())))}")
+    dam_results = fetch_dams(client, set(dam_models.values()), start_date, end_date, workers)
+
+    # Process each model
+    for model_name, dam_id in dam_models.items():
+        logging.info(f"Processing model: {model_name}")
+
+        # Fold the CSV written by earlier versions into the store once
+        migrate_legacy_csv(store, dam_id, f"data/output/{model_name}/dam_data/{model_name}.csv")
+
+        # Process and merge the data
+        dam_data = dam_results[dam_id]
+        result_df = process_data(dam_id, dam_data["TMA"], dam_data["INFLOW"], dam_data["OUTFLOW"])
+
+        # Upsert only the fetched timestamps
+        count = store.upsert(dam_id, result_df)
+        logging.info(f"Stored {count} records of dam {dam_id} for model {model_name}")
+
+
+def backfill(client, store, dam_ids, start_day, end_day, window_days, workers):
+    """Fetch and store an arbitrary date range, window by window.
+
+    Each window is stored and checkpointed as soon as its three endpoints
+    have returned; windows already checkpointed are skipped, so an
+    interrupted backfill resumes where it stopped. Windows with a failed
+    request are not checkpointed and are retried by the next run.
+    """
+    windows = split_date_range(start_day, end_day, window_days)
+    jobs = []
+    for dam_id in dam_ids:
+        done = store.completed_windows(dam_id)
+        todo = [window for window in windows if window not in done]
+        logging.info(f"Backfill of dam {dam_id}: {len(todo)} of {len(windows)} windows to fetch.")
+        jobs.extend((dam_id, window) for window in todo)
+
+    failed = 0
+    for dam_id, window, data, complete in fetch_windows(client, jobs, workers):
+        if not complete:
+            failed += 1
+            continue
+        count = store.upsert(dam_id, process_data(dam_id, data["TMA"], data["INFLOW"], data["OUTFLOW"]))
+        store.complete_window(dam_id, *window)
+        logging.info(f"Stored {count} records of dam {dam_id} for {window[0]} - {window[1]}")
+
+    if failed:
+        logging.warning(f"{failed} backfill windows failed; run the backfill again to retry them.")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect dam telemetry from the SDA API.")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"),
+                        help="fetch the days START to END (YYYY-MM-DD, inclusive) instead of today")
+    parser.add_argument("--window-days", type=int, help="days per API request during a backfill")
+    args = parser.parse_args()
 
-# Main logic
-if __name__ == "__main__":
     try:
         # Load configuration
         with open(CONFIG_PATH, "r") as file:
@@ -109,49 +279,31 @@ if __name__ == "__main__":
 
         logging.info(f"Loaded credentials: USERNAME={USERNAME}")
 
-        # Authenticate and get token
-        token = authenticate(USERNAME, PASSWORD)
-
-        # Get today's date range
-        start_date, end_date = get_today_date_range()
+        # One pooled client for all dams; it authenticates on first use
+        workers = shared_config.get("dam_workers", 8)
+        client = SdaClient(USERNAME, PASSWORD, max_connections=workers,
+                           rate_limit=shared_config.get("dam_rate_limit"))
+        store = DamStore(shared_config.get("dam_store", "data/output/dam_data.sqlite"))
 
         # Extract model settings
-        models_config = config.get("models", {})
+        dam_models = dam_ids_by_model(config.get("models", {}))
 
-        # Process each model
-        for model_name, model_details in models_config.items():
-            logging.info(f"Processing model: {model_name}")
+        try:
+            if args.backfill:
+                start_day, end_day = (datetime.strptime(day, "%Y-%m-%d") for day in args.backfill)
+                window_days = args.window_days or shared_config.get("dam_window_days", 7)
+                if backfill(client, store, set(dam_models.values()), start_day, end_day, window_days, workers):
+                    sys.exit(1)
+            else:
+                collect_today(client, store, dam_models, workers)
+        finally:
+            client.close()
+            store.close()
+    except Exception as e:
+        logging.error(f"An error occurred: {e}", exc_info=True)
+        sys.exit(1)
 
-            # Extract the dam ID
-            dam_id = model_details.get("dam_id")
-            if not dam_id:
-                logging.warning(f"No dam_id specified for model: {model_name}. Skipping...")
-                continue
 
-            # Ensure output path exists
-            output_path = f"data/output/{model_name}/dam_data/"
-            os.makedirs(output_path, exist_ok=True)
-
-            logging.info(f"Fetching data for Dam ID: {dam_id}")
-
-            # Fetch TMA, Inflow, and Outflow data
-            tma_data = get_data(TMA_URL, token, dam_id, start_date, end_date)
-            inflow_data = get_data(INFLOW_URL, token, dam_id, start_date, end_date)
-            outflow_data = get_data(OUTFLOW_URL, token, dam_id, start_date, end_date)
-
-            # Process and merge the data
-            result_df = process_data(tma_data, inflow_data, outflow_data)
-
-            # Save to CSV
-            csv_filename = os.path.join(output_path, f"{model_name}.csv")
-            if os.path.exists(csv_filename):
-                # Load existing data
-                existing_data = pd.read_csv(csv_filename)
-                # Append new data
-                result_df = pd.concat([existing_data, result_df]).drop_duplicates(subset=["timestamp"])
-            
-            # Save back to CSV
-            result_df.to_csv(csv_filename, index=False)
-            logging.info(f"Data for model {model_name} saved to {csv_filename}")
-    except Exception as e:
-        logging.error(f"An error occurred: {e}", exc_info=True)
\ No newline at end of file
+# Main logic
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+
+
+OUTFLOW_COMPONENTS = [
+    "outflow_turbin", "outflow_abaku",
+    "outflow_aindustri", "outflow_irigasi",
+    "outflow_limpas", "outflow_pemeliharaan",
+]
+
+# Value fields each endpoint's records must carry besides "timestamp"
+REQUIRED_FIELDS = {
+    "TMA": ["volume", "tma"],
+    "INFLOW": ["inflow"],
+    "OUTFLOW": OUTFLOW_COMPONENTS,
+}
+
+# Fields of which a record needs at least one; the missing ones stay NaN
+PARTIAL_FIELDS = {
+    "OUTFLOW": OUTFLOW_COMPONENTS,
+}
+
+REJECTED_COLUMNS = ["dam_id", "endpoint", "reason", "timestamp", "record"]
+
+
+def parse_records(endpoint, records, dam_id):
+    """Parse an endpoint's JSON records into typed columns, validating them in bulk.
+
+    Only the required fields are read: timestamps become datetime64 and
+    values float32. A record whose timestamp or any required value is
+    missing or not parseable is rejected instead of failing the whole batch;
+    for ``PARTIAL_FIELDS`` only a record missing all of them is rejected.
+    Returns ``(df, rejected)``: the valid rows indexed by timestamp, and the
+    rejected rows with the reason and the original record.
+    """
+    fields = REQUIRED_FIELDS[endpoint]
+    partial = PARTIAL_FIELDS.get(endpoint, [])
+    raw = pd.DataFrame.from_records(records, columns=["timestamp"] + fields)
+
+    df = pd.DataFrame({"timestamp": pd.to_datetime(raw["timestamp"], errors="coerce", format="ISO8601")})
+    for field in fields:
+        df[field] = pd.to_numeric(raw[field], errors="coerce").astype("float32")
+
+    invalid = df.isna()
+    if partial:
+        invalid[partial] = invalid[partial] & invalid[partial].all(axis=1).to_numpy()[:, None]
+    bad = invalid.any(axis=1)
+    rejected = pd.DataFrame({
+        "dam_id": str(dam_id),
+        "endpoint": endpoint,
+        "reason": "invalid " + invalid[bad].dot(invalid.columns + " ").str.strip().str.replace(" ", ", "),
+        "timestamp": raw.loc[bad, "timestamp"],
+        "record": [str(records[i]) for i in bad.to_numpy().nonzero()[0]],
+    }, columns=REJECTED_COLUMNS)
+
+    df = df[~bad].drop_duplicates("timestamp", keep="last").set_index("timestamp")
+    return df, rejected
+
+
+def combine_endpoints(dam_id, tma, inflow, outflow):
+    """Align the parsed TMA, INFLOW and OUTFLOW frames of a dam on their timestamps.
+
+    Total outflow is the row-wise sum of its reported components. Returns
+    one row per timestamp with a categorical ``dam_id`` and float32 values.
+    """
+    outflow = outflow[OUTFLOW_COMPONENTS].sum(axis=1, min_count=1).astype("float32").rename("outflow").to_frame()
+    merged = pd.concat([tma, inflow, outflow], axis=1, join="outer").sort_index()
+    merged = merged.rename_axis("timestamp").reset_index()
+    merged.insert(0, "dam_id", pd.Categorical([str(dam_id)] * len(merged)))
+    return merged
+
+
+def write_rejected_report(rejected, report_path):
+    """Append rejected records to a CSV report."""
+    if rejected.empty:
+        return
+    report_dir = os.path.dirname(report_path)
+    if report_dir:
+        os.makedirs(report_dir, exist_ok=True)
+    rejected.assign(rejected_at=pd.Timestamp.now().floor("s")).to_csv(
+        report_path, mode="a", index=False, header=not os.path.exists(report_path))
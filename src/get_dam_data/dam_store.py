@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import logging
+from datetime import datetime
+import pandas as pd
+
+
+# Measured values kept per dam and timestamp
+VALUE_COLUMNS = ["volume", "tma", "inflow", "outflow"]
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class DamStore:
+    """Dam time series in SQLite, one row per (dam_id, timestamp).
+
+    Rows are upserted, so storing the same records twice is a no-op and a
+    later partial record (e.g. outflow arriving after TMA) fills in the
+    missing values without erasing the known ones. Each run only touches
+    the timestamps it fetched.
+    """
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS observations (
+                dam_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                {", ".join(f"{column} REAL" for column in VALUE_COLUMNS)},
+                PRIMARY KEY (dam_id, timestamp)
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backfill_windows (
+                dam_id TEXT NOT NULL,
+                window_start TEXT NOT NULL,
+                window_end TEXT NOT NULL,
+                completed_at TEXT,
+                PRIMARY KEY (dam_id, window_start, window_end)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def upsert(self, dam_id, df):
+        """Insert or update the rows of a DataFrame with a ``timestamp`` column. Returns the row count."""
+        if df.empty:
+            return 0
+        rows = pd.DataFrame({"timestamp": pd.to_datetime(df["timestamp"]).dt.strftime(TIMESTAMP_FORMAT)})
+        for column in VALUE_COLUMNS:
+            rows[column] = pd.to_numeric(df[column], errors="coerce") if column in df else None
+        rows = rows.dropna(subset=["timestamp"]).astype(object).where(rows.notna(), None)
+
+        updates = ", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in VALUE_COLUMNS)
+        with self.conn:
+            self.conn.executemany(
+                f"""
+                INSERT INTO observations (dam_id, timestamp, {", ".join(VALUE_COLUMNS)})
+                VALUES (?, ?, {", ".join("?" for _ in VALUE_COLUMNS)})
+                ON CONFLICT (dam_id, timestamp) DO UPDATE SET {updates}
+                """,
+                ((str(dam_id), *row) for row in rows.itertuples(index=False)),
+            )
+        return len(rows)
+
+    def query(self, dam_id, start=None, end=None):
+        """Observations of a dam between ``start`` and ``end`` (inclusive), indexed by timestamp."""
+        sql = f"SELECT timestamp, {', '.join(VALUE_COLUMNS)} FROM observations WHERE dam_id = ?"
+        params = [str(dam_id)]
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(pd.Timestamp(start).strftime(TIMESTAMP_FORMAT))
+        if end is not None:
+            sql += " AND timestamp <= ?"
+            params.append(pd.Timestamp(end).strftime(TIMESTAMP_FORMAT))
+        sql += " ORDER BY timestamp"
+        df = pd.read_sql_query(sql, self.conn, params=params, parse_dates=["timestamp"])
+        return df.set_index("timestamp")
+
+    def completed_windows(self, dam_id):
+        """Set of ``(start, end)`` backfill windows already stored for a dam."""
+        rows = self.conn.execute(
+            "SELECT window_start, window_end FROM backfill_windows WHERE dam_id = ?", (str(dam_id),)
+        ).fetchall()
+        return set(rows)
+
+    def complete_window(self, dam_id, window_start, window_end):
+        """Checkpoint a backfill window of a dam as stored."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO backfill_windows (dam_id, window_start, window_end, completed_at) VALUES (?, ?, ?, ?)",
+                (str(dam_id), window_start, window_end, datetime.now().isoformat(timespec="seconds")),
+            )
+
+    def latest_timestamp(self, dam_id):
+        """Most recent stored timestamp of a dam, or None."""
+        row = self.conn.execute("SELECT MAX(timestamp) FROM observations WHERE dam_id = ?", (str(dam_id),)).fetchone()
+        return pd.Timestamp(row[0]) if row[0] else None
+
+
+def migrate_legacy_csv(store, dam_id, csv_path):
+    """Load a model's old ``dam_data/<model>.csv`` into the store once, then rename it."""
+    if not os.path.exists(csv_path):
+        return 0
+    count = store.upsert(dam_id, pd.read_csv(csv_path))
+    os.replace(csv_path, csv_path + ".migrated")
+    logging.info(f"Migrated {count} rows of {csv_path} into the dam store.")
+    return count
@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import yaml
+
+# The stage modules are imported once, so their libraries stay loaded between cycles
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for stage_dir in ("data_import", "visualization", "animation", "forecast"):
+    sys.path.append(os.path.join(SRC_DIR, stage_dir))
+sys.path.append(os.path.abspath(os.path.join(SRC_DIR, "..", "shared")))
+
+import crop_ecmwf
+import rain_thiessen
+import rain_animation
+import results_store
+from state_store import open_state_store
+
+
+# Stages recorded per model and cycle date; import and forecast are recorded by their own scripts
+THIESSEN_STAGE = "thiessen"
+ANIMATION_STAGE = "animation"
+IMPORT_STAGE = "import"
+FORECAST_STAGE = "forecast"
+RESULTS_STAGE = "results_store"
+
+
+def load_config(config_path="shared/config.yaml"):
+    """Load configuration from a YAML file."""
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)
+
+
+def setup_logger(log_file="logs/pipeline_daemon.log"):
+    """Set up a logger."""
+    log_dir = os.path.dirname(log_file)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    return logging.getLogger()
+
+
+class StageServer:
+    """A Jython stage kept running in ``--serve`` mode, so its JVM starts only once."""
+
+    def __init__(self, name, command, logger):
+        self.name = name
+        self.command = command
+        self.logger = logger
+        self.process = None
+
+    def start(self):
+        self.logger.info(f"Starting resident {self.name} stage: {' '.join(self.command)}")
+        self.process = subprocess.Popen(
+            self.command + ["--serve"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1
+        )
+
+    def run(self, args=()):
+        """Run the stage once with the given arguments and return its exit code.
+
+        A stage process that has died is restarted first.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        self.process.stdin.write(" ".join(args) + "\n")
+        self.process.stdin.flush()
+        for line in self.process.stdout:
+            if line.startswith("DONE "):
+                return int(line.split()[1])
+        self.logger.error(f"Resident {self.name} stage exited with code {self.process.wait()}.")
+        return 1
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def stage_servers(logger):
+    """The resident Jython stages, started on first use."""
+    return {
+        "import": StageServer("import", ["cmd.exe", "/c", os.path.join("src", "data_import", "import_automation.bat")], logger),
+        "forecast": StageServer("forecast", ["cmd.exe", "/c", os.path.join("src", "forecast", "forecast_hec_hms.bat")], logger),
+    }
+
+
+class RetrySchedule:
+    """Exponential backoff of failed handlers, per (stage, model, date).
+
+    A handler that failed ``n`` times is retried ``base_seconds * 2 ** (n - 1)``
+    seconds after its last failure, at most ``max_seconds`` later.
+    """
+
+    def __init__(self, base_seconds, max_seconds):
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.failures = {}
+
+    def due(self, key):
+        if key not in self.failures:
+            return True
+        count, failed_at = self.failures[key]
+        delay = min(self.base_seconds * 2 ** (count - 1), self.max_seconds)
+        return time.monotonic() >= failed_at + delay
+
+    def record(self, key, ok):
+        if ok:
+            self.failures.pop(key, None)
+        else:
+            count = self.failures.get(key, (0, None))[0] + 1
+            self.failures[key] = (count, time.monotonic())
+
+
+def cycle_date(nc_file):
+    """Date ``YYYYMMDD`` of a raw ECMWF file, from its name."""
+    return os.path.basename(nc_file).split(".")[2][:8]
+
+
+def load_cube(nc_file):
+    """Read a cycle's rain cube once, shared by the Thiessen and animation handlers.
+
+    Returns the animation dataset (``x``/``y`` dimensions, EPSG:4326) and the
+    Thiessen view of the same array.
+    """
+    dataset = rain_animation.open_rain_dataset(nc_file).load()
+    cube = {
+        "rain": dataset["rain"].values,
+        "dates": pd.to_datetime(dataset["time"].values).to_pydatetime(),
+    }
+    return dataset, cube
+
+
+def due_models(stage, model_names, date_str, state, retries):
+    """Models whose ``stage`` is not done for the cycle and not waiting for a retry."""
+    return [name for name in model_names
+            if not state.is_done(stage, name, date_str) and retries.due((stage, name, date_str))]
+
+
+def run_handler(stage, model_names, date_str, handler, state, retries, logger):
+    """Run a handler for the models that claim ``stage``, recording the outcome of each."""
+    claimed = [name for name in model_names if state.claim(stage, name, date_str)]
+    if not claimed:
+        return
+    try:
+        handler(claimed)
+    except Exception as e:
+        logger.exception(f"{stage} handler failed for {', '.join(claimed)}.")
+        for name in claimed:
+            state.fail(stage, name, date_str, e)
+            retries.record((stage, name, date_str), False)
+        return
+    for name in claimed:
+        state.complete(stage, name, date_str)
+        retries.record((stage, name, date_str), True)
+
+
+def run_server_stage(server, stage, model_names, date_str, args, state, retries, logger):
+    """Run a resident stage for ``model_names`` and schedule a retry for those it did not finish."""
+    if not model_names:
+        return
+    code = server.run(list(args) + ["--models"] + model_names)
+    for name in model_names:
+        ok = state.is_done(stage, name, date_str)
+        retries.record((stage, name, date_str), ok)
+        if not ok:
+            logger.error(f"{stage} of {name} for {date_str} not done (exit code {code}), retrying later.")
+
+
+def process_cycle(nc_file, config, servers, state, retries, logger):
+    """Run the stages of one ECMWF cycle that are not done yet. Returns True once all are done.
+
+    Each handler's outcome is recorded per model and cycle date in the
+    state store, so a later call reruns only what failed, once its backoff
+    has passed. The file is cropped into the cache first; the DSS import
+    then runs in its resident JVM on that cropped copy while the cube is
+    loaded once from it for the Thiessen charts and animations. The
+    forecast and the results store follow the import.
+    """
+    models = config["models"]
+    shared_config = config["shared"]
+    date_str = cycle_date(nc_file)
+
+    try:
+        data_file = crop_ecmwf.update_cache(nc_file, config, logger)
+    except Exception:
+        logger.exception(f"Cropping {nc_file} failed, reading the full grid.")
+        data_file = nc_file
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        import_run = executor.submit(
+            run_server_stage, servers["import"], IMPORT_STAGE, due_models(IMPORT_STAGE, models, date_str, state, retries),
+            date_str, ["--file", nc_file], state, retries, logger,
+        )
+
+        thiessen_models = due_models(THIESSEN_STAGE, models, date_str, state, retries)
+        animation_models = due_models(ANIMATION_STAGE, models, date_str, state, retries)
+        if thiessen_models or animation_models:
+            start = time.monotonic()
+            dataset, cube = load_cube(data_file)
+            logger.info(f"Loaded {data_file} in {time.monotonic() - start:.1f} s")
+
+            def thiessen(names):
+                loggers = rain_thiessen.model_loggers(config)
+                rain_thiessen.run_thiessen(config, nc_file, {name: loggers[name] for name in names}, cube)
+
+            run_handler(THIESSEN_STAGE, thiessen_models, date_str, thiessen, state, retries, logger)
+
+            cmap, norm = rain_animation.create_custom_colormap()
+            for model_name in animation_models:
+                def animation(names):
+                    rain_animation.process_model_rain_animation(
+                        names[0], models[names[0]], shared_config, cmap, norm, dataset)
+
+                run_handler(ANIMATION_STAGE, [model_name], date_str, animation, state, retries, logger)
+
+        import_run.result()
+
+    forecast_models = [name for name in due_models(FORECAST_STAGE, models, date_str, state, retries)
+                       if state.is_done(IMPORT_STAGE, name, date_str)]
+    run_server_stage(servers["forecast"], FORECAST_STAGE, forecast_models, date_str, [], state, retries, logger)
+
+    store_root = shared_config.get("results_store", "data/output/results")
+    for model_name in due_models(RESULTS_STAGE, models, date_str, state, retries):
+        if not state.is_done(FORECAST_STAGE, model_name, date_str):
+            continue
+
+        def ingest(names):
+            forecast_dir = os.path.join("data", "output", names[0], "forecast", date_str)
+            results_store.ingest_forecast_exports(store_root, names[0], date_str, forecast_dir, logger)
+
+        run_handler(RESULTS_STAGE, [model_name], date_str, ingest, state, retries, logger)
+
+    stages = (THIESSEN_STAGE, ANIMATION_STAGE, IMPORT_STAGE, FORECAST_STAGE, RESULTS_STAGE)
+    return all(state.is_done(stage, name, date_str) for stage in stages for name in models)
+
+
+def retry_schedule(config):
+    shared_config = config["shared"]
+    return RetrySchedule(shared_config.get("daemon_retry_seconds", 300), shared_config.get("daemon_retry_max_seconds", 3600))
+
+
+def serve(config, state, logger, poll_seconds):
+    """Watch the raw folder and process each new cycle with the warm handlers.
+
+    A cycle is checked on every poll until all of its stages are done.
+    """
+    servers = stage_servers(logger)
+    retries = retry_schedule(config)
+    raw_folder = config["shared"].get("raw_folder", "data/raw")
+    done = set()
+    try:
+        while True:
+            yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
+            nc_file = rain_thiessen.find_yesterdays_file(raw_folder, yesterday, logger)
+            if nc_file and nc_file not in done:
+                if process_cycle(nc_file, config, servers, state, retries, logger):
+                    logger.info(f"Cycle {nc_file} complete.")
+                    done.add(nc_file)
+            time.sleep(poll_seconds)
+    finally:
+        for server in servers.values():
+            server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident pipeline that processes each ECMWF cycle with warm handlers.")
+    parser.add_argument("--once", metavar="NC_FILE", help="process one file and exit")
+    args = parser.parse_args()
+
+    config = load_config()
+    logger = setup_logger()
+    state = open_state_store(config)
+
+    try:
+        if args.once:
+            servers = stage_servers(logger)
+            try:
+                sys.exit(0 if process_cycle(args.once, config, servers, state, retry_schedule(config), logger) else 1)
+            finally:
+                for server in servers.values():
+                    server.close()
+
+        serve(config, state, logger, config["shared"].get("daemon_poll_seconds", 60))
+    finally:
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from state_store import open_state_store
+
+
+# Stage outcomes
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+def load_config(config_path="shared/config.yaml"):
+    """Load configuration from a YAML file."""
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)
+
+
+def setup_logger(log_file="logs/pipeline.log"):
+    """Set up a logger."""
+    log_dir = os.path.dirname(log_file)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    return logging.getLogger()
+
+
+def build_stages(config):
+    """Declare the pipeline stages, their dependencies and their inputs and outputs.
+
+    ``inputs`` and ``outputs`` are glob patterns, expanded when the stage is
+    checked so they see what upstream stages wrote; ``records`` are
+    ``(stage, model, date)`` items that must be done in the state store. A
+    stage is current when every output pattern matches, the outputs are
+    newer than the inputs and all its records are done; a stage without
+    outputs or records always runs.
+    """
+    shared_config = config["shared"]
+    models = config["models"]
+    raw_folder = shared_config.get("raw_folder", "data/raw")
+    store_root = shared_config.get("results_store", "data/output/results")
+    animation_format = shared_config.get("animation_format", "gif")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
+    today = datetime.now().strftime("%Y%m%d")
+    python = sys.executable
+
+    raw = [os.path.join(raw_folder, f"ECMWF_new_3d.0125.{yesterday}*.PREC.nc")]
+    forecast_exports = [os.path.join("data", "output", model_name, "forecast", yesterday, "*.csv") for model_name in models]
+
+    return {
+        "download": {
+            "command": [python, "src/data_import/import_ftp_ecmwf.py"],
+            "deps": [],
+            "inputs": [],
+            "outputs": raw,
+            "records": [],
+        },
+        "thiessen": {
+            "command": [python, "src/visualization/rain_thiessen.py"],
+            "deps": ["download"],
+            "inputs": raw,
+            "outputs": [os.path.join(model_config["thiessen_output"], f"{model_name}_thiessen_{today}.jpg")
+                        for model_name, model_config in models.items()],
+            "records": [],
+        },
+        "animation": {
+            "command": [python, "src/animation/rain_animation.py"],
+            "deps": ["download"],
+            "inputs": raw,
+            "outputs": [os.path.join(model_config["animation_output"], f"rainfall_{model_name}_{today}.{animation_format}")
+                        for model_name, model_config in models.items()],
+            "records": [],
+        },
+        "dam_data": {
+            "command": [python, "src/get_dam_data/dam_data.py"],
+            "deps": [],
+            "inputs": [],
+            "outputs": [],
+            "records": [],
+        },
+        "import": {
+            "command": ["cmd.exe", "/c", os.path.join("src", "data_import", "import_automation.bat")],
+            "deps": ["download"],
+            "inputs": [],
+            "outputs": [],
+            "records": [("import", model_name, yesterday) for model_name in models],
+        },
+        "forecast": {
+            "command": ["cmd.exe", "/c", os.path.join("src", "forecast", "forecast_hec_hms.bat")],
+            "deps": ["import"],
+            "inputs": [],
+            "outputs": [],
+            "records": [("forecast", model_name, yesterday) for model_name in models],
+        },
+        "results_store": {
+            "command": [python, "src/forecast/results_store.py"],
+            "deps": ["forecast"],
+            "inputs": forecast_exports,
+            "outputs": [os.path.join(store_root, f"model={model_name}", f"date={yesterday}")
+                        for model_name, model_config in models.items() if model_config.get("results")],
+            "records": [],
+        },
+    }
+
+
+def is_current(stage, state):
+    """True if a stage's outputs and state store records are already up to date."""
+    if not stage["outputs"] and not stage["records"]:
+        return False
+    outputs = [glob.glob(pattern) for pattern in stage["outputs"]]
+    if not all(outputs):
+        return False
+    if not all(state.is_done(*record) for record in stage["records"]):
+        return False
+    inputs = [path for pattern in stage["inputs"] for path in glob.glob(pattern)]
+    if inputs and outputs:
+        newest_input = max(os.path.getmtime(path) for path in inputs)
+        oldest_output = min(os.path.getmtime(path) for paths in outputs for path in paths)
+        return oldest_output >= newest_input
+    return True
+
+
+def run_stage(name, stage, logger):
+    """Run one stage as a subprocess. Returns (status, start, end)."""
+    start = time.monotonic()
+    logger.info(f"Starting stage {name}: {' '.join(stage['command'])}")
+    result = subprocess.run(stage["command"])
+    end = time.monotonic()
+    status = DONE if result.returncode == 0 else FAILED
+    logger.log(logging.INFO if status == DONE else logging.ERROR,
+               f"Stage {name} {status} in {end - start:.1f} s (exit code {result.returncode})")
+    return status, start, end
+
+
+def run_pipeline(stages, state, workers, logger, force=False):
+    """Run the stages on a pool as soon as their dependencies have finished.
+
+    A stage whose outputs are current is skipped without running; a failed
+    stage blocks everything downstream of it while independent stages go on.
+    Returns ``{stage: (status, start, end)}`` with monotonic times.
+    """
+    results = {}
+    running = {}
+    pipeline_start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(results) < len(stages):
+            for name, stage in stages.items():
+                if name in results or name in running.values():
+                    continue
+                dep_status = [results.get(dep, (None,))[0] for dep in stage["deps"]]
+                if any(status in (FAILED, BLOCKED) for status in dep_status):
+                    logger.warning(f"Stage {name} blocked by a failed dependency.")
+                    now = time.monotonic()
+                    results[name] = (BLOCKED, now, now)
+                elif all(status in (DONE, SKIPPED) for status in dep_status):
+                    if not force and is_current(stage, state):
+                        logger.info(f"Stage {name} is current, skipping.")
+                        now = time.monotonic()
+                        results[name] = (SKIPPED, now, now)
+                    else:
+                        running[executor.submit(run_stage, name, stage, logger)] = name
+
+            if len(results) == len(stages):
+                break
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[running.pop(future)] = future.result()
+
+    return {name: (status, start - pipeline_start, end - pipeline_start) for name, (status, start, end) in results.items()}
+
+
+def critical_path(stages, results):
+    """Longest chain of dependent stages by duration, and its length in seconds."""
+    finish = {}
+    previous = {}
+
+    def chain_end(name):
+        if name not in finish:
+            deps = stages[name]["deps"]
+            longest = max(deps, key=chain_end, default=None)
+            previous[name] = longest
+            status, start, end = results[name]
+            finish[name] = (end - start) + (chain_end(longest) if longest else 0.0)
+        return finish[name]
+
+    last = max(stages, key=chain_end)
+    path = [last]
+    while previous[path[-1]]:
+        path.append(previous[path[-1]])
+    return path[::-1], finish[last]
+
+
+def timing_report(stages, results):
+    """Per-stage timings, the critical path and the wall time as text lines."""
+    lines = [f"{'stage':<15}{'status':<10}{'start':>9}{'duration':>11}"]
+    for name, (status, start, end) in sorted(results.items(), key=lambda item: item[1][1]):
+        lines.append(f"{name:<15}{status:<10}{start:>8.1f}s{end - start:>10.1f}s")
+    path, length = critical_path(stages, results)
+    wall = max(end for _, _, end in results.values())
+    lines.append(f"critical path: {' -> '.join(path)} ({length:.1f} s of {wall:.1f} s wall time)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the forecast pipeline stages in dependency order.")
+    parser.add_argument("--force", action="store_true", help="run every stage even if its outputs are current")
+    parser.add_argument("--workers", type=int, help="number of stages run at the same time")
+    args = parser.parse_args()
+
+    config = load_config()
+    logger = setup_logger()
+    stages = build_stages(config)
+    workers = args.workers or config["shared"].get("pipeline_workers", 3)
+
+    state = open_state_store(config)
+    try:
+        results = run_pipeline(stages, state, workers, logger, force=args.force)
+    finally:
+        state.close()
+    for line in timing_report(stages, results):
+        logger.info(line)
+        print(line)
+
+    if any(status in (FAILED, BLOCKED) for status, _, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 import os
+import sys
 import numpy as np
 import pandas as pd
 from netCDF4 import Dataset, num2date
 from datetime import datetime, timedelta
 import yaml
 import matplotlib.pyplot as plt
+from thiessen_weights import load_or_build_area_weights
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from rain_cache import DEFAULT_FOLDER, grid_offset, model_shapefiles, preferred_file
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
 
 def load_config(config_path="shared/config.yaml"):
@@ -45,13 +55,87 @@ def find_yesterdays_file(raw_folder, yesterday, logger):
     return None
 
 
-def load_nc_file(nc_path):
-    """Load NetCDF file and extract rainfall data."""
-    data = Dataset(nc_path)
-    rain = data.variables["rain"][:, :, :]  # Adjust variable name if necessary
-    time = data.variables["time"][:]
-    dates = num2date(time, data.variables["time"].units)
-    return rain, dates
+def _decode(values, var):
+    """Apply fill value, scale and offset of a raw variable read, returning float32 with NaN gaps."""
+    values = values.astype(np.float32)
+    for attr in ("_FillValue", "missing_value"):
+        if attr in var.ncattrs():
+            values[values == np.float32(var.getncattr(attr))] = np.nan
+    if "scale_factor" in var.ncattrs():
+        values *= np.float32(var.scale_factor)
+    if "add_offset" in var.ncattrs():
+        values += np.float32(var.add_offset)
+    return values
+
+
+def _memmap_variable(nc_path, variable):
+    """Memory-map a variable stored contiguously and uncompressed in an HDF5-based NetCDF file.
+
+    Returns None when the layout does not allow it or h5py is not installed.
+    """
+    if h5py is None:
+        return None
+    try:
+        with h5py.File(nc_path, "r") as f:
+            dataset = f[variable]
+            offset = dataset.id.get_offset()
+            if dataset.chunks is not None or dataset.compression is not None or offset is None:
+                return None
+            return np.memmap(nc_path, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+    except (OSError, KeyError):
+        return None
+
+
+def _read_hyperslabs(var, lat_idx, lon_idx):
+    """Read the full time series of (lat, lon) cells with one hyperslab per storage chunk.
+
+    Cells falling in the same chunk are fetched together as the bounding box
+    of those cells, so each chunk is decompressed at most once.
+    """
+    chunking = var.chunking()
+    if chunking == "contiguous":
+        chunk_lat, chunk_lon = var.shape[1], var.shape[2]
+    else:
+        chunk_lat, chunk_lon = chunking[1], chunking[2]
+
+    values = np.empty((var.shape[0], len(lat_idx)), dtype=var.dtype)
+    tiles = (lat_idx // chunk_lat) * (var.shape[2] // chunk_lon + 1) + lon_idx // chunk_lon
+    for tile in np.unique(tiles):
+        members = np.flatnonzero(tiles == tile)
+        lat0, lat1 = lat_idx[members].min(), lat_idx[members].max() + 1
+        lon0, lon1 = lon_idx[members].min(), lon_idx[members].max() + 1
+        block = var[:, lat0:lat1, lon0:lon1]
+        values[:, members] = block[:, lat_idx[members] - lat0, lon_idx[members] - lon0]
+    return values
+
+
+def load_rain_points(nc_path, lat_idx, lon_idx, use_mmap=True):
+    """Read rainfall only for the given grid cells instead of the whole cube.
+
+    Returns a compact ``(time, n_points)`` float32 array with NaN for missing
+    values, plus the dates. Uncompressed contiguous files are memory-mapped
+    when ``use_mmap`` is set; otherwise the cells are read chunk by chunk.
+    """
+    lat_idx = np.asarray(lat_idx, dtype=np.intp)
+    lon_idx = np.asarray(lon_idx, dtype=np.intp)
+    cells, inverse = np.unique(np.stack([lat_idx, lon_idx], axis=1), axis=0, return_inverse=True)
+    cell_lat, cell_lon = cells[:, 0], cells[:, 1]
+
+    with Dataset(nc_path) as data:
+        var = data.variables["rain"]
+        var.set_auto_maskandscale(False)
+
+        mapped = _memmap_variable(nc_path, "rain") if use_mmap else None
+        if mapped is not None:
+            values = np.asarray(mapped[:, cell_lat, cell_lon])
+        else:
+            values = _read_hyperslabs(var, cell_lat, cell_lon)
+        values = _decode(values, var)
+
+        time = data.variables["time"][:]
+        dates = num2date(time, data.variables["time"].units)
+
+    return values[:, inverse.ravel()], dates
 
 
 def load_thiessen_from_excel(excel_path):
@@ -61,13 +145,43 @@ def load_thiessen_from_excel(excel_path):
     return indices
 
 
-def calculate_thiessen_rain(rain, indices):
-    """Calculate Thiessen-weighted rain for specific locations."""
-    weighted_rain = np.zeros((rain.shape[0], len(indices)))
-    for i, (lat_idx, lon_idx, factor) in enumerate(indices):
-        weighted_rain[:, i] = rain[:, lat_idx, lon_idx] * factor
-    total_rain = weighted_rain.sum(axis=1)
-    return total_rain
+def load_thiessen_indices(nc_path, model_name, model_config, cache_folder, logger):
+    """Load a model's Thiessen table from basin polygons, or from Excel if configured.
+
+    Excel indices refer to the full ECMWF grid and are shifted onto the grid
+    of ``nc_path`` when it is a basin-cropped file.
+    """
+    if model_config.get("thiessen_weights", "polygons") == "excel":
+        indices = load_thiessen_from_excel(model_config["thiessen_excel"])
+        lat_offset, lon_offset = grid_offset(nc_path)
+        indices = [(lat_idx - lat_offset, lon_idx - lon_offset, factor) for lat_idx, lon_idx, factor in indices]
+        if any(lat_idx < 0 or lon_idx < 0 for lat_idx, lon_idx, _ in indices):
+            raise ValueError(f"Thiessen points of {model_name} fall outside the cropped grid of {nc_path}.")
+        return indices
+    return load_or_build_area_weights(nc_path, model_name, model_config, cache_folder, logger)
+
+
+def build_weight_table(basin_indices):
+    """Stack the Thiessen (lat_idx, lon_idx, factor) lists of several basins into flat arrays.
+
+    Points are stored basin by basin; ``offsets[j]`` is the first point of
+    basin ``j``, so a per-basin sum is a single ``np.add.reduceat``.
+    """
+    counts = [len(indices) for indices in basin_indices]
+    if 0 in counts:
+        raise ValueError("Every basin needs at least one Thiessen point.")
+    points = np.array([point for indices in basin_indices for point in indices], dtype=float)
+    lat_idx = points[:, 0].astype(np.intp)
+    lon_idx = points[:, 1].astype(np.intp)
+    weights = points[:, 2]
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp)
+    return lat_idx, lon_idx, weights, offsets
+
+
+def reduce_basin_rain(point_rain, weight_table):
+    """Weight already-gathered ``(time, point)`` rainfall and sum it per basin into ``(time, basin)``."""
+    _, _, weights, offsets = weight_table
+    return np.add.reduceat(np.nan_to_num(point_rain) * weights, offsets, axis=1)
 
 
 def plot_rainfall(rain, dates, output_path, chart_name):
@@ -90,43 +204,79 @@ def plot_rainfall(rain, dates, output_path, chart_name):
     plt.close()
 
 
-def main():
-    # Load configuration
-    config = load_config()
-    shared_config = config["shared"]
+def run_thiessen(config, nc_file, loggers, cube=None):
+    """Calculate and plot the Thiessen rainfall of every model from one ECMWF file.
+
+    The basin-cropped copy of ``nc_file`` is read when the cache has a
+    current one. ``cube`` is an already loaded ``{"rain": (time, lat, lon)
+    array, "dates": [...]}`` of that same file, e.g. from the pipeline
+    daemon; without it only the Thiessen cells are read.
+    """
+    today = datetime.now().strftime("%Y%m%d")
+    model_names = list(loggers)
+    shp_paths = [shp_path for name in model_names for shp_path in model_shapefiles(config["models"][name])]
+    nc_file = preferred_file(nc_file, config["shared"].get("ecmwf_cache", DEFAULT_FOLDER), shp_paths)
+
+    # Load Thiessen indices and factors and stack them into one table
+    cache_folder = config["shared"].get("cache_folder", "data/cache")
+    basin_indices = [
+        load_thiessen_indices(nc_file, name, config["models"][name], cache_folder, loggers[name]) for name in model_names
+    ]
+    weight_table = build_weight_table(basin_indices)
 
+    # Read only the Thiessen cells of all models from the NetCDF file
+    lat_idx, lon_idx, _, _ = weight_table
+    if cube is not None:
+        point_rain, dates = cube["rain"][:, lat_idx, lon_idx], cube["dates"]
+    else:
+        point_rain, dates = load_rain_points(nc_file, lat_idx, lon_idx)
+
+    # Calculate Thiessen rain for every model in one pass
+    basin_rain = reduce_basin_rain(point_rain, weight_table)
+
+    for j, model_name in enumerate(model_names):
+        model_config = config["models"][model_name]
+        output_path = model_config["thiessen_output"]
+        chart_name = f"{model_name}_thiessen_{today}.jpg"
+
+        # Plot rainfall
+        plot_rainfall(basin_rain[:, j], dates, output_path, chart_name)
+
+        loggers[model_name].info(f"Thiessen rainfall calculation and plotting completed successfully for {model_name}.")
+
+
+def model_loggers(config):
+    """Set up the Thiessen logger of every model."""
+    loggers = {}
     for model_name, model_config in config["models"].items():
         # Prepare logger
         log_file = os.path.join(model_config["thiessen_output"], f"{model_name}_thiessen_calculation.log")
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        logger = setup_logger(log_file)
+        loggers[model_name] = setup_logger(log_file)
+    return loggers
 
-        # Prepare file paths
-        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
-        today = datetime.now().strftime("%Y%m%d")
-        nc_file = find_yesterdays_file(shared_config["raw_folder"], yesterday, logger)
 
-        if not nc_file:
-            logger.error(f"No NetCDF file available for {model_name}. Skipping this model.")
-            continue
-
-        thiessen_excel = model_config["thiessen_excel"]
-        output_path = model_config["thiessen_output"]
-        chart_name = f"{model_name}_thiessen_{today}.jpg"
+def main():
+    # Load configuration
+    config = load_config()
+    shared_config = config["shared"]
 
-        # Load NetCDF file
-        rain, dates = load_nc_file(nc_file)
+    # Prepare file paths
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
 
-        # Load Thiessen indices and factors from Excel
-        indices = load_thiessen_from_excel(thiessen_excel)
+    loggers = model_loggers(config)
+    if not loggers:
+        return
 
-        # Calculate Thiessen rain
-        thiessen_rain = calculate_thiessen_rain(rain, indices)
+    model_names = list(loggers)
+    nc_file = find_yesterdays_file(shared_config["raw_folder"], yesterday, loggers[model_names[0]])
 
-        # Plot rainfall
-        plot_rainfall(thiessen_rain, dates, output_path, chart_name)
+    if not nc_file:
+        for model_name in model_names:
+            loggers[model_name].error(f"No NetCDF file available for {model_name}. Skipping this model.")
+        return
 
-        logger.info(f"Thiessen rainfall calculation and plotting completed successfully for {model_name}.")
+    run_thiessen(config, nc_file, loggers)
 
 
 if __name__ == "__main__":
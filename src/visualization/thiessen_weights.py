@@ -0,0 +1,98 @@
+import os
+import sys
+import hashlib
+import numpy as np
+import geopandas as gpd
+import shapely
+from netCDF4 import Dataset
+from shapely import STRtree
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "shared")))
+from geometry_cache import read_geometry
+from shapefiles import shapefile_digest
+
+
+WEIGHTS_VERSION = "1"
+
+
+def read_grid_coords(nc_path):
+    """Read the 1-D latitude and longitude coordinates of the ECMWF grid."""
+    with Dataset(nc_path) as data:
+        lat_name = "lat" if "lat" in data.variables else "latitude"
+        lon_name = "lon" if "lon" in data.variables else "longitude"
+        return np.asarray(data.variables[lat_name][:], dtype=float), np.asarray(data.variables[lon_name][:], dtype=float)
+
+
+def cell_edges(centers):
+    """Cell edges halfway between centres, extrapolated half a cell at both ends."""
+    mid = (centers[:-1] + centers[1:]) / 2
+    return np.concatenate([[centers[0] - (mid[0] - centers[0])], mid, [centers[-1] + (centers[-1] - mid[-1])]])
+
+
+def compute_area_weights(lat, lon, basin, projected_crs):
+    """Exact area fractions of the basin covered by each grid cell.
+
+    Grid cells are built as lat/lon boxes and indexed in an STRtree; only the
+    cells whose boxes intersect the basin (in EPSG:4326) are clipped, and the
+    clipped pieces are measured in the model's projected CRS. Returns ``(lat_idx, lon_idx,
+    weight)`` arrays with weights summing to 1.
+    """
+    basin_geometry = basin.geometry.union_all()
+
+    lat_edges, lon_edges = cell_edges(lat), cell_edges(lon)
+    lat_idx, lon_idx = np.meshgrid(np.arange(len(lat)), np.arange(len(lon)), indexing="ij")
+    lat_idx, lon_idx = lat_idx.ravel(), lon_idx.ravel()
+    cells = shapely.box(
+        np.minimum(lon_edges[lon_idx], lon_edges[lon_idx + 1]),
+        np.minimum(lat_edges[lat_idx], lat_edges[lat_idx + 1]),
+        np.maximum(lon_edges[lon_idx], lon_edges[lon_idx + 1]),
+        np.maximum(lat_edges[lat_idx], lat_edges[lat_idx + 1]),
+    )
+
+    candidates = STRtree(cells).query(basin_geometry, predicate="intersects")
+    pieces = shapely.intersection(cells[candidates], basin_geometry)
+    areas = gpd.GeoSeries(pieces, crs="EPSG:4326").to_crs(projected_crs).area.to_numpy()
+
+    keep = areas > 0
+    weights = areas[keep] / areas[keep].sum()
+    return lat_idx[candidates][keep], lon_idx[candidates][keep], weights
+
+
+def weights_key(lat, lon, basin_shp, projected_crs):
+    """Content hash of everything the weights depend on."""
+    digest = hashlib.sha1()
+    digest.update(WEIGHTS_VERSION.encode())
+    digest.update(np.ascontiguousarray(lat).tobytes())
+    digest.update(np.ascontiguousarray(lon).tobytes())
+    digest.update(shapefile_digest(basin_shp).encode())
+    digest.update(str(projected_crs).encode())
+    return digest.hexdigest()
+
+
+def load_or_build_area_weights(nc_path, model_name, model_config, cache_folder, logger):
+    """Return a model's Thiessen table ``(n, 3)`` of lat index, lon index and weight.
+
+    Weights are cached as ``.npz`` under ``<cache_folder>/thiessen``, named by
+    a hash of the grid coordinates, the basin shapefile and the projected CRS,
+    so a new grid or an edited shapefile rebuilds them automatically.
+    """
+    lat, lon = read_grid_coords(nc_path)
+    basin_shp = model_config["basin_shp"]
+    projected_crs = model_config["projected_crs"]
+    key = weights_key(lat, lon, basin_shp, projected_crs)
+
+    weights_dir = os.path.join(cache_folder, "thiessen")
+    os.makedirs(weights_dir, exist_ok=True)
+    path = os.path.join(weights_dir, f"{model_name}_{key}.npz")
+
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return np.column_stack([cached["lat_idx"], cached["lon_idx"], cached["weight"]])
+
+    logger.info(f"Building area-weighted Thiessen weights for {model_name}: {path}")
+    basin = read_geometry(basin_shp, "EPSG:4326", cache_folder)
+    lat_idx, lon_idx, weight = compute_area_weights(lat, lon, basin, projected_crs)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, lat_idx=lat_idx, lon_idx=lon_idx, weight=weight)
+    os.replace(tmp_path, path)
+    return np.column_stack([lat_idx, lon_idx, weight])